@@ -0,0 +1,118 @@
+"""
+Benchmark the single-pass HTML to markdown conversion of fetch_html against the previous
+BeautifulSoup + markdownify pipeline, on the HTML fixtures in benchmarks/fixtures.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.html_to_md [--repeat 20] [--scale 20] [extra.html ...]
+
+--scale repeats the main content of each fixture, to simulate large documentation pages.
+"""
+
+import argparse
+import pathlib
+import re
+import statistics
+import time
+
+from bs4 import BeautifulSoup
+from markdownify import markdownify
+
+import tools.html_to_md
+from tools.html_to_md import html_to_markdown
+
+FIXTURES_DIR = pathlib.Path(__file__).parent / "fixtures"
+
+
+def legacy_html_to_markdown(html: str):
+    """
+    The conversion as fetch_html did it before: clean with BeautifulSoup, serialize, and markdownify
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+    for tag in soup.find_all():
+        for attr in list(tag.attrs):  # type: ignore
+            if attr.lower().startswith("on"):
+                del tag.attrs[attr]  # type: ignore
+    return markdownify(
+        str(soup),
+        convert=[
+            "a",
+            "p",
+            "h1",
+            "h2",
+            "h3",
+            "h4",
+            "h5",
+            "h6",
+            "ul",
+            "ol",
+            "li",
+            "strong",
+            "em",
+            "blockquote",
+            "img",
+        ],
+    )
+
+
+def stdlib_html_to_markdown(html: str):
+    """
+    The single-pass conversion, forced to use the html.parser fallback (as if lxml is not installed)
+    """
+    etree, tools.html_to_md.etree = tools.html_to_md.etree, None
+    try:
+        return html_to_markdown(html)
+    finally:
+        tools.html_to_md.etree = etree
+
+
+def scale(html: str, factor: int):
+    match = re.search(r"<(article|main)\b.*?</\1>", html, re.S | re.I)
+    if not match or factor <= 1:
+        return html
+    return html[: match.end()] + match.group(0) * (factor - 1) + html[match.end() :]
+
+
+def timeit(func, html: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(html)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", type=pathlib.Path)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=20)
+    args = parser.parse_args()
+
+    engines = {
+        "markdownify": legacy_html_to_markdown,
+        "single-pass (html.parser)": stdlib_html_to_markdown,
+    }
+    if tools.html_to_md.etree is not None:
+        engines["single-pass (lxml)"] = html_to_markdown
+
+    files = sorted(FIXTURES_DIR.glob("*.html")) + args.files
+    print(f"{'fixture':<20} {'size':>9} " + " ".join(f"{e:>26}" for e in engines))
+    for path in files:
+        html = scale(path.read_text(), args.scale)
+        timings = {
+            name: timeit(func, html, args.repeat) for name, func in engines.items()
+        }
+        baseline = timings["markdownify"]
+        print(
+            f"{path.stem:<20} {len(html) // 1024:>6} KB "
+            + " ".join(
+                f"{ms:>15.1f} ms ({baseline / ms:>4.1f}x)" for ms in timings.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
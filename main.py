@@ -233,6 +233,9 @@ def agent():
             ## Fetching Web pages
             - For each web search result, fetch at least the top 2 web pages.
             - Do this in parallel, for example if you have 3 web search results, you would execute 3 * 2 = 6 fetches
+            - Prefer a single fetch_many_html call over many separate fetch_html calls
+            - Prefer a single web_search_many call over many separate web_search calls
+            - For quick lookups, search with include_snippets=True: the snippets may answer the question without fetching pages
             """
         )
         .strip()
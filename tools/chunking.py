@@ -0,0 +1,317 @@
+"""
+Structure-aware chunking of markdown documents into pages of a limited nr of (estimated) tokens,
+and addressing of sections within them.
+
+Pages are broken at block boundaries (paragraphs, lists, code blocks, tables) and preferably before headings.
+Blocks that are too large for a single page are split by lines, keeping code fences and table headers intact.
+"""
+
+import math
+import re
+from dataclasses import dataclass, field
+
+HEADING = re.compile(r"^(#{1,6}) +(.+?) *#*$")
+FENCE = re.compile(r"^ *(```|~~~)")
+
+# A page is broken before a heading once it is filled for at least this fraction of the budget
+HEADING_BREAK_FILL = 0.5
+
+
+def heading_title(heading: str):
+    """
+    The plain text of a heading, without links, images and permalink symbols
+    """
+    title = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", heading)
+    title = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", title)
+    title = re.sub(r"[*_`]", "", title)
+    return title.strip(" ¶#§🔗").strip()
+
+
+def estimate_tokens(text: str):
+    """
+    Rough token estimate (about 4 characters per token for English text and code)
+    """
+    return math.ceil(len(text) / 4)
+
+
+@dataclass
+class Chunk:
+    text: str
+    headings: list[str] = field(default_factory=list)
+    """The headings of the sections that start in this chunk"""
+    continues: str | None = None
+    """The heading of the section that this chunk continues, if it doesn't start with a heading"""
+
+
+def split_blocks(markdown: str) -> list[str]:
+    """
+    Split markdown into blocks: headings, paragraphs, lists, code blocks and tables
+    """
+    blocks: list[str] = []
+    current: list[str] = []
+    fence: str | None = None
+
+    def close():
+        if current:
+            blocks.append("\n".join(current))
+            current.clear()
+
+    for line in markdown.split("\n"):
+        if fence:
+            current.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                close()
+            continue
+        fence_match = FENCE.match(line)
+        if fence_match:
+            close()
+            fence = fence_match.group(1)
+            current.append(line)
+        elif HEADING.match(line):
+            close()
+            blocks.append(line)
+        elif not line.strip():
+            close()
+        elif current and current[0].startswith("|") != line.startswith("|"):
+            close()  # Tables are blocks of their own
+            current.append(line)
+        else:
+            current.append(line)
+    close()
+    return blocks
+
+
+def _split_block(block: str, max_tokens: int) -> list[str]:
+    """
+    Split a block that exceeds the budget by lines, repeating code fences and table headers in each piece
+    """
+    lines = block.split("\n")
+    opener, closer, header = "", "", []
+    if FENCE.match(lines[0]):
+        opener = lines.pop(0)
+        if lines and FENCE.match(lines[-1]):
+            closer = lines.pop()
+        else:
+            closer = opener.strip()[:3]
+    elif lines[0].startswith("|") and len(lines) > 2:
+        header, lines = lines[:2], lines[2:]
+
+    overhead = estimate_tokens("\n".join([opener, closer, *header]))
+    budget = max(1, max_tokens - overhead)
+    pieces: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+
+    def close():
+        if current:
+            body = [*header, *current]
+            if opener:
+                body = [opener, *body, closer]
+            pieces.append("\n".join(body))
+            current.clear()
+
+    for line in lines:
+        # Lines that don't fit a page on their own, are cut
+        for start in range(0, max(1, len(line)), budget * 4):
+            part = line[start : start + budget * 4]
+            part_tokens = estimate_tokens(part) + 1
+            if current and current_tokens + part_tokens > budget:
+                close()
+                current_tokens = 0
+            current.append(part)
+            current_tokens += part_tokens
+    close()
+    return pieces
+
+
+def chunk_markdown(markdown: str, max_tokens: int) -> list[Chunk]:
+    """
+    Split markdown into chunks of at most (about) max_tokens each, respecting block boundaries and headings
+    """
+    chunks: list[Chunk] = []
+    blocks: list[str] = []
+    tokens = 0
+    section: str | None = None
+    chunk_section: str | None = None
+
+    def close():
+        nonlocal tokens, chunk_section
+        if blocks:
+            headings = [
+                heading_title(m.group(2)) for b in blocks if (m := HEADING.match(b))
+            ]
+            chunks.append(
+                Chunk(
+                    text="\n\n".join(blocks),
+                    headings=headings,
+                    continues=None if HEADING.match(blocks[0]) else chunk_section,
+                )
+            )
+            blocks.clear()
+        tokens = 0
+        chunk_section = section
+
+    def add(block: str):
+        nonlocal tokens, section, chunk_section
+        block_tokens = estimate_tokens(block) + 1
+        heading = HEADING.match(block)
+        if blocks and (
+            tokens + block_tokens > max_tokens
+            or (heading and tokens >= max_tokens * HEADING_BREAK_FILL)
+        ):
+            # Don't leave headings dangling at the end of a chunk
+            dangling = []
+            while len(blocks) > 1 and HEADING.match(blocks[-1]):
+                dangling.insert(0, blocks.pop())
+            close()
+            for dangling_heading in dangling:
+                blocks.append(dangling_heading)
+                tokens += estimate_tokens(dangling_heading) + 1
+        if heading:
+            section = heading_title(heading.group(2))
+            if not blocks:
+                chunk_section = section
+        blocks.append(block)
+        tokens += block_tokens
+
+    for block in split_blocks(markdown):
+        if estimate_tokens(block) + 1 > max_tokens:
+            # Leave some room for a heading that might precede the first piece
+            for piece in _split_block(block, int(max_tokens * 0.9)):
+                add(piece)
+        else:
+            add(block)
+    close()
+    return chunks or [Chunk(text="")]
+
+
+@dataclass
+class Section:
+    level: int
+    title: str
+    anchors: list[str]
+    """The slug of the title, and the ids of the HTML elements that belong to the section"""
+    start: int
+    end: int
+    """Character offsets of the section (including its subsections) in the markdown"""
+
+
+def slugify(title: str):
+    """
+    GitHub style anchor for a heading, e.g. "Getting Started!" -> "getting-started"
+    """
+    slug = re.sub(r"[^\w\- ]", "", title.lower())
+    return slug.strip().replace(" ", "-")
+
+
+def outline(markdown: str, heading_anchors: list[list[str]] | None = None):
+    """
+    The sections of the markdown document, in order of appearance.
+
+    If heading_anchors (from html_to_markdown) match the headings, they are added to the section anchors.
+    """
+    headings: list[tuple[int, str, int]] = []
+    offset = 0
+    fence: str | None = None
+    for line in markdown.split("\n"):
+        if fence:
+            if line.strip().startswith(fence):
+                fence = None
+        elif fence_match := FENCE.match(line):
+            fence = fence_match.group(1)
+        elif heading := HEADING.match(line):
+            headings.append((len(heading.group(1)), heading.group(2), offset))
+        offset += len(line) + 1
+
+    if heading_anchors is None or len(heading_anchors) != len(headings):
+        heading_anchors = [[] for _ in headings]
+
+    sections: list[Section] = []
+    for i, ((level, heading, start), anchors) in enumerate(
+        zip(headings, heading_anchors)
+    ):
+        end = next(
+            (
+                next_start
+                for next_level, _, next_start in headings[i + 1 :]
+                if next_level <= level
+            ),
+            len(markdown),
+        )
+        title = heading_title(heading)
+        sections.append(
+            Section(
+                level=level,
+                title=title,
+                anchors=list(dict.fromkeys([slugify(title), *anchors])),
+                start=start,
+                end=end,
+            )
+        )
+    return sections
+
+
+def find_section(sections: list[Section], section: str):
+    """
+    Find a section by anchor (e.g. "#installation") or by title (e.g. "Installation")
+    """
+    wanted = section.strip().lstrip("#").strip()
+    for matches in (
+        lambda s: wanted in s.anchors,
+        lambda s: wanted.lower() in (a.lower() for a in s.anchors),
+        lambda s: slugify(wanted) in s.anchors,
+        lambda s: wanted.lower() == s.title.lower(),
+        lambda s: wanted.lower() in s.title.lower(),
+    ):
+        for candidate in sections:
+            if matches(candidate):
+                return candidate
+    return None
+
+
+def page_index(
+    chunks: list[Chunk],
+    current_page: int,
+    max_headings: int = 4,
+    max_pages: int = 20,
+    nearby: int = 2,
+):
+    """
+    A compact table of contents of the chunks, so the reader can jump to the page with the section they need.
+
+    At most max_pages pages are listed, so the index doesn't grow with the length of the document: the first page,
+    the pages near the current page, and then pages that start sections, spread over the document.
+    Runs of pages that are left out are shown as a single "…" line.
+    """
+    pages = {1, *range(current_page - nearby, current_page + nearby + 1)}
+    pages = {page for page in pages if 1 <= page <= len(chunks)}
+    section_pages = [
+        page
+        for page, chunk in enumerate(chunks, 1)
+        if chunk.headings and page not in pages
+    ]
+    remaining = max(0, max_pages - len(pages))
+    if len(section_pages) > remaining:
+        section_pages = [
+            section_pages[i * len(section_pages) // remaining] for i in range(remaining)
+        ]
+    pages.update(section_pages)
+
+    lines = []
+    previous = 0
+    for page in sorted(pages):
+        if page > previous + 1:
+            lines.append("  …")
+        previous = page
+        chunk = chunks[page - 1]
+        titles = chunk.headings[:max_headings]
+        if len(chunk.headings) > max_headings:
+            titles.append("…")
+        if chunk.continues:
+            titles.insert(0, f"(continued) {chunk.continues}")
+        marker = " (this page)" if page == current_page else ""
+        lines.append(f"  page {page}{marker}: {' | '.join(titles) or '(no headings)'}")
+    if previous < len(chunks):
+        lines.append("  …")
+    return "\n".join(lines)
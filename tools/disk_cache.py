@@ -0,0 +1,92 @@
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = pathlib.Path(
+    os.environ.get(
+        "RESEARCH_AGENT_CACHE_DIR",
+        pathlib.Path.home() / ".cache" / "research-agent",
+    )
+)
+
+
+class DiskCache:
+    """
+    A size-bounded key/value store in SQLite, shared by all threads (and processes) of the agent.
+
+    Each entry holds a JSON-serializable dict of metadata, and an optional binary body.
+    When the total size of the entries exceeds max_bytes, the least recently used entries are evicted.
+    Expiry is left to the caller, as the rules for that differ per use case (e.g. HTTP caching).
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.path = CACHE_DIR / f"{name}.db"
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._lock:
+                if not self._initialized:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS entries ("
+                        "key TEXT PRIMARY KEY, meta TEXT NOT NULL, body BLOB NOT NULL, "
+                        "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+                    )
+                    conn.execute(
+                        "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+                    )
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> tuple[dict, bytes] | None:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT meta, body FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, meta: dict, body: bytes = b""):
+        serialized = json.dumps(meta)
+        size = len(key) + len(serialized) + len(body)
+        if size > self.max_bytes:
+            return
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, meta, body, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, serialized, body, size, time.time()),
+        )
+        self._evict(conn)
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn: sqlite3.Connection):
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at"
+        ):
+            evict.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", evict)
@@ -0,0 +1,178 @@
+"""
+Shared fetch engine of the web research tools.
+
+Concurrent fetches (e.g. by fetch_many_html) are orchestrated on a single asyncio event loop, that runs in
+a background thread. The blocking HTTP calls themselves run in one bounded, process-wide I/O thread pool,
+so the nr of threads no longer grows with the nr of concurrent tool calls and conversations.
+
+Tools stay synchronous: they hand their calls to run_all, which blocks until the calls are done,
+the deadline has passed, or the stop event was set.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+# Max nr of blocking HTTP calls in flight, process-wide
+IO_THREADS = int(os.environ.get("RESEARCH_AGENT_IO_THREADS", 32))
+
+_io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="web-io")
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="web-engine", daemon=True
+            ).start()
+        return _loop
+
+
+async def to_thread(fn: Callable[..., T], *args) -> T:
+    """
+    Run a blocking function in the shared I/O thread pool.
+
+    Wrap fn with AgentContext.copy_context().run if it needs the agent context.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, fn, *args)
+
+
+class HostLimiter:
+    """
+    Limits the nr of concurrent calls per host, process-wide.
+
+    Slots are taken on the engine's event loop, before a call is handed to the I/O thread pool,
+    so calls that wait for a slot don't occupy a thread of the pool.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        # The semaphores of the hosts that calls are running or waiting for, with their nr of calls.
+        # Hosts without calls are dropped, so this doesn't grow with the nr of hosts ever called.
+        # Only used on the event loop, so no lock is needed
+        self._hosts: dict[str, tuple[asyncio.Semaphore, int]] = {}
+
+    def _enter(self, host: str):
+        semaphore, calls = self._hosts.get(host, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit)
+        self._hosts[host] = (semaphore, calls + 1)
+        return semaphore
+
+    def _exit(self, host: str):
+        semaphore, calls = self._hosts[host]
+        if calls == 1:
+            del self._hosts[host]
+        else:
+            self._hosts[host] = (semaphore, calls - 1)
+
+    async def run(self, host: str, fn: Callable[..., T], *args) -> T:
+        """
+        Run a blocking function in the shared I/O thread pool, once there's a slot for the host.
+
+        The slot is held until the function returns, also if the caller stops waiting for it (e.g. at a deadline).
+        """
+        semaphore = self._enter(host)
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._exit(host)
+            raise
+
+        def release(call: asyncio.Future):
+            semaphore.release()
+            self._exit(host)
+            if not call.cancelled():
+                call.exception()  # Retrieve it, so an abandoned call that failed isn't logged as such
+
+        call = asyncio.ensure_future(to_thread(fn, *args))
+        call.add_done_callback(release)
+        return await asyncio.shield(call)
+
+
+def spawn(coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+    """
+    Run a coroutine on the engine's event loop in the background
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+
+def run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the engine's event loop, and block until it is done
+    """
+    return spawn(coroutine).result()
+
+
+async def _run_all(
+    calls: list[Callable[[], T]],
+    limit: int,
+    deadline_at: float | None,
+    stop_event: threading.Event | None,
+    on_done: Callable[[int, T], None] | None,
+    host_limiter: HostLimiter | None,
+    hosts: list[str] | None,
+):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(i: int, call: Callable[[], T]):
+        async with semaphore:
+            if host_limiter:
+                return await host_limiter.run(hosts[i], call)
+            return await to_thread(call)
+
+    tasks = {asyncio.ensure_future(bounded(i, call)): i for i, call in enumerate(calls)}
+    results: dict[int, T] = {}
+    pending = set(tasks)
+    try:
+        while pending and not (stop_event and stop_event.is_set()):
+            timeout = 0.5
+            if deadline_at is not None:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = min(remaining, timeout)
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                results[tasks[task]] = task.result()
+                if on_done:
+                    # In the I/O thread pool, as it may block (e.g. emitting a trace), and the loop is shared
+                    await to_thread(on_done, tasks[task], results[tasks[task]])
+    finally:
+        # Calls that are already running in the I/O pool complete in the background
+        for task in pending:
+            task.cancel()
+    return results
+
+
+def run_all(
+    calls: list[Callable[[], T]],
+    *,
+    limit: int,
+    deadline_at: float | None = None,
+    stop_event: threading.Event | None = None,
+    on_done: Callable[[int, T], None] | None = None,
+    host_limiter: HostLimiter | None = None,
+    hosts: list[str] | None = None,
+) -> dict[int, T]:
+    """
+    Run the calls concurrently, at most limit at a time, and return the results by index of the call.
+
+    Calls that didn't finish before the deadline (time.monotonic) or before the stop event was set are abandoned,
+    and left out of the results. on_done is called (in the I/O thread pool) for each finished call, one at a time.
+    With a host_limiter, each call first waits for a slot for its host (hosts, by index of the call).
+    """
+    return run(
+        _run_all(calls, limit, deadline_at, stop_event, on_done, host_limiter, hosts)
+    )
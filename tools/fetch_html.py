@@ -1,43 +1,612 @@
+import asyncio
+import codecs
+import concurrent.futures
 import functools
+import os
 import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
 
 import requests
-from bs4 import BeautifulSoup
 from generative_ai_toolkit.agent import registry
 from generative_ai_toolkit.context import AgentContext
-from markdownify import markdownify
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 
+from tools import engine, http_cache, http_client
+from tools.chunking import (
+    Chunk,
+    Section,
+    chunk_markdown,
+    estimate_tokens,
+    find_section,
+    outline,
+    page_index,
+)
+from tools.html_to_md import html_to_markdown
+from tools.http_cache import canonical_url
+from tools.readability import extract_article
 from tools.registries import web_research
+from tools.singleflight import SingleFlight
 
+# Max nr of pages fetched concurrently by fetch_many_html (per call), and per host (process-wide)
+MAX_PARALLEL_FETCHES = 8
+MAX_FETCHES_PER_HOST = 2
 
-@functools.lru_cache(25)
-def get_session(principal_id: str, conversation_id: str):
-    return requests.Session()
+# Max total size of converted documents kept in memory, so that pagination doesn't refetch and reconvert
+DOCUMENT_CACHE_MAX_BYTES = int(
+    os.environ.get("RESEARCH_AGENT_DOC_CACHE_MAX_BYTES", 256 * 1024**2)
+)
 
+# Long documents are returned in pages of this nr of (estimated) tokens
+PAGE_TOKENS = int(os.environ.get("RESEARCH_AGENT_FETCH_PAGE_TOKENS", 2_500))
 
-def _clean_html(html: str):
-    soup = BeautifulSoup(html, "html.parser")
+# Max nr of pages listed in the index of sections per page, that is added to each page of a long document
+MAX_INDEXED_PAGES = 20
 
-    # Remove <script> and <style> tags
-    for tag in soup(["script", "style"]):
-        tag.decompose()
+# If the main content extracted for the "article" format has less than this share of the text of the page
+# (or none at all), the extraction is assumed to have missed it, and the whole page is returned instead
+MIN_ARTICLE_RATIO = 0.05
 
-    # Optionally, remove inline JS event handlers (like onclick)
-    for tag in soup.find_all():
-        for attr in list(tag.attrs):  # type: ignore
-            if attr.lower().startswith("on"):
-                del tag.attrs[attr]  # type: ignore
+# Downloads are stopped (and the page truncated) beyond this size
+MAX_DOWNLOAD_BYTES = int(os.environ.get("RESEARCH_AGENT_FETCH_MAX_BYTES", 10 * 1024**2))
 
-    clean_html = str(soup)
-    return clean_html
+# Nr of web_search results that are fetched into the document cache in the background (0 to disable),
+# and the max bandwidth (bytes per second, process-wide) used for that
+PREFETCH_TOP_K = int(os.environ.get("RESEARCH_AGENT_PREFETCH_TOP_K", 3))
+PREFETCH_MAX_BYTES_PER_SECOND = int(
+    os.environ.get("RESEARCH_AGENT_PREFETCH_MAX_BYTES_PER_SECOND", 1024**2)
+)
+PREFETCH_MAX_PARALLEL = 2
+
+# Add comprehensive browser-like headers to avoid bot detection
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Referer": "https://www.google.com/",
+    "DNT": "1",  # Do Not Track
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Sec-Ch-Ua": '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"Windows"',
+}
+
+_host_limiter = engine.HostLimiter(MAX_FETCHES_PER_HOST)
+
+
+def _host(url: str):
+    return (urlsplit(url).hostname or "").lower()
+
+
+class _FetchError(Exception):
+    pass
+
+
+class _Interrupted(_FetchError):
+    """
+    The fetch was stopped for reasons of the caller (deadline, stop event), rather than of the URL
+    """
+
+
+def _validate_headers(headers: CaseInsensitiveDict):
+    content_type = headers.get("Content-Type", "")
+
+    # Improved content type checking - use regex to match base content type
+    if not (
+        re.search(r"text/html", content_type, re.I)
+        or re.search(r"application/xhtml\+xml", content_type, re.I)
+    ):
+        raise _FetchError(
+            f"Error: Unsupported content type: {content_type}. Cannot convert to markdown."
+        )
+
+
+def _validate_sample(headers: CaseInsensitiveDict, sample: bytes):
+    # Check if response content appears to be binary/non-text, by decoding a sample of it.
+    # Decode incrementally, so a multi-byte character cut off at the end of the sample is no problem
+    try:
+        decoder = codecs.getincrementaldecoder(
+            get_encoding_from_headers(headers) or "utf-8"
+        )()
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        is_binary = "\x00" in decoder.decode(sample[:1000], final=False)
+    except UnicodeDecodeError:
+        is_binary = True
+    if is_binary:
+        raise _FetchError(
+            "Error: Content appears to be binary data, not text/HTML. Cannot convert to markdown."
+        )
+
+
+@dataclass
+class _Document:
+    content: str
+    chunks: list[Chunk]
+    sections: list[Section] = field(default_factory=list)
+    download_bytes: int = 0
+    prefetched: bool = False
+
+    @property
+    def size(self):
+        return sys.getsizeof(self.content) + sum(
+            sys.getsizeof(chunk.text) for chunk in self.chunks
+        )
+
+
+class _DocumentCache:
+    """
+    In-process LRU cache of converted documents, evicting the least recently used ones
+    once the total size exceeds max_bytes
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._documents: OrderedDict[tuple, _Document] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: tuple):
+        with self._lock:
+            return key in self._documents
+
+    def get(self, key: tuple):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._documents.move_to_end(key)
+            return document
+
+    def put(self, key: tuple, document: _Document):
+        if document.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._documents:
+                self.size -= self._documents.pop(key).size
+            self._documents[key] = document
+            self.size += document.size
+            while self.size > self.max_bytes:
+                _, evicted = self._documents.popitem(last=False)
+                self.size -= evicted.size
+
+
+_documents = _DocumentCache(max_bytes=DOCUMENT_CACHE_MAX_BYTES)
+_downloads = SingleFlight()
+
+
+def _document_key(context: AgentContext, url: str, format: str):
+    return (canonical_url(url), format, context.conversation_id)
+
+
+def _download(
+    context: AgentContext,
+    session: requests.Session,
+    url: str,
+    deadline_at: float | None,
+):
+    if context.stop_event.is_set():
+        raise _Interrupted("Error: Aborted due to stop event")
+    if deadline_at is not None and time.monotonic() >= deadline_at:
+        raise _Interrupted("Error: Deadline exceeded")
+    return http_cache.get(
+        session,
+        url,
+        headers=HEADERS,
+        timeout=30.0,
+        max_bytes=MAX_DOWNLOAD_BYTES,
+        validate_headers=_validate_headers,
+        validate_sample=_validate_sample,
+    )
+
+
+def _load_document(
+    context: AgentContext,
+    url: str,
+    format: str,
+    deadline_at: float | None = None,
+    prefetch: bool = False,
+):
+    """
+    Fetch the URL and convert it to the requested format, or serve it from the document cache.
+
+    Prefetches run in the background, outside of the tool invocation, so they don't record trace attributes.
+    """
+    current_trace = None if prefetch else context.tracer.current_trace
+
+    def record(attribute_key: str, attribute_value):
+        if current_trace is not None:
+            current_trace.add_attribute(attribute_key, attribute_value)
+
+    key = _document_key(context, url, format)
+    if not prefetch:
+        # Join the prefetch of this document if its download has started. A prefetch that is still queued
+        # (or throttled) is cancelled instead, so the fetch doesn't wait for background work
+        with _prefetches_lock:
+            prefetching = _prefetches.get(key)
+            if prefetching is not None and not prefetching.started:
+                prefetching.cancelled = True
+                del _prefetches[key]
+                prefetching = None
+        if prefetching is not None:
+            try:
+                prefetching.done.result(
+                    timeout=(
+                        30.0
+                        if deadline_at is None
+                        else max(0.0, deadline_at - time.monotonic())
+                    )
+                )
+            except concurrent.futures.TimeoutError:
+                pass
+    document = _documents.get(key)
+    record("ai.tool.doc_cache", "hit" if document is not None else "miss")
+    record("ai.tool.doc_cache.hits", _documents.hits)
+    record("ai.tool.doc_cache.misses", _documents.misses)
+    if document is not None:
+        record("ai.tool.doc_cache.prefetched", document.prefetched)
+        return document
+
+    # Concurrent fetches of the same URL (e.g. from other conversations) are joined, rather than repeated.
+    # If this conversation has cookies for the URL, the response may be specific to them: then only fetches
+    # of this conversation are joined
+    session = http_client.get_session(
+        context.auth_context["principal_id"], context.conversation_id
+    )
+    download_key = canonical_url(url)
+    isolated = http_cache.sends_cookies(session, url)
+    if isolated:
+        download_key = (
+            download_key,
+            context.auth_context["principal_id"],
+            context.conversation_id,
+        )
+    while True:
+        try:
+            response, shared = _downloads.do(
+                download_key, lambda: _download(context, session, url, deadline_at)
+            )
+            if shared and not isolated and response.personalized:
+                # The joined response is specific to the cookies of another conversation, fetch our own
+                response = _download(context, session, url, deadline_at)
+                shared = False
+            break
+        except _Interrupted:
+            if context.stop_event.is_set() or (
+                deadline_at is not None and time.monotonic() >= deadline_at
+            ):
+                raise
+            # The fetch that was joined was interrupted, but this one wasn't: try again
+    record("ai.tool.http_cache", "coalesced" if shared else response.cache_status)
+    record("ai.tool.download_bytes", len(response.content))
+
+    # Get the text content with proper encoding
+    html_content = response.text
+
+    # Check if content is actually HTML (basic validation)
+    if not re.search(r"<html|<body|<div|<p|<h[1-6]|<!DOCTYPE", html_content, re.I):
+        raise _FetchError(
+            "Error: Content doesn't appear to be valid HTML. Cannot convert to markdown."
+        )
+
+    heading_anchors: list[list[str]] = []
+    if format == "md":
+        content = html_to_markdown(html_content, heading_anchors)
+    elif format == "article":
+        article_html, compression_ratio = extract_article(html_content)
+        content = html_to_markdown(article_html, heading_anchors)
+        record("ai.tool.article.compression_ratio", round(compression_ratio, 3))
+        if not content.strip() or compression_ratio < MIN_ARTICLE_RATIO:
+            heading_anchors.clear()
+            content = html_to_markdown(html_content, heading_anchors)
+            record("ai.tool.article.fallback", True)
+    else:
+        content = html_content
+
+    if response.truncated:
+        content += f"\n\n[... download stopped at the max size of {MAX_DOWNLOAD_BYTES:,} bytes ...]"
+
+    document = _Document(
+        content,
+        chunk_markdown(content, PAGE_TOKENS),
+        outline(content, heading_anchors) if format != "html" else [],
+        download_bytes=len(response.content),
+        prefetched=prefetch,
+    )
+    _documents.put(key, document)
+    return document
+
+
+class _Bandwidth:
+    """
+    Paces downloads, so that on average they don't use more than bytes_per_second
+    """
+
+    def __init__(self, bytes_per_second: int):
+        self.bytes_per_second = bytes_per_second
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    async def wait(self, stop_event: threading.Event):
+        """
+        Wait until the next download may start; returns False if the stop event was set in the meantime
+        """
+        while not stop_event.is_set():
+            with self._lock:
+                remaining = self._next_at - time.monotonic()
+            if remaining <= 0:
+                return True
+            await asyncio.sleep(min(remaining, 0.1))
+        return False
+
+    def consumed(self, nr_bytes: int):
+        with self._lock:
+            self._next_at = (
+                max(self._next_at, time.monotonic()) + nr_bytes / self.bytes_per_second
+            )
+
+
+@dataclass
+class _Prefetch:
+    done: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+    started: bool = False
+    cancelled: bool = False
+
+
+_prefetches: dict[tuple, _Prefetch] = {}
+_prefetches_lock = threading.Lock()
+_prefetch_bandwidth = _Bandwidth(PREFETCH_MAX_BYTES_PER_SECOND)
+
+
+async def _prefetch(
+    context: AgentContext,
+    prefetches: list[tuple[str, tuple, _Prefetch]],
+):
+    semaphore = asyncio.Semaphore(PREFETCH_MAX_PARALLEL)
+
+    def load(url: str, prefetching: _Prefetch):
+        with _prefetches_lock:
+            if prefetching.cancelled:
+                return None
+            prefetching.started = True
+        return _load_document(context, url, "md", None, True)
+
+    async def prefetch_one(url: str, key: tuple, prefetching: _Prefetch):
+        try:
+            async with semaphore:
+                if await _prefetch_bandwidth.wait(context.stop_event):
+                    document = await _host_limiter.run(
+                        _host(url), context.copy_context().run, load, url, prefetching
+                    )
+                    if document is not None:
+                        _prefetch_bandwidth.consumed(document.download_bytes)
+        except Exception:
+            pass  # Prefetching is best effort, a later fetch_html will report the error
+        finally:
+            with _prefetches_lock:
+                if _prefetches.get(key) is prefetching:
+                    del _prefetches[key]
+            prefetching.done.set_result(None)
+
+    await asyncio.gather(*(prefetch_one(*prefetch) for prefetch in prefetches))
+
+
+def prefetch(context: AgentContext, urls: list[str]):
+    """
+    Start fetching the URLs (in the default "md" format) into the document cache in the background,
+    so that subsequent fetch_html calls for them are served from the cache.
+
+    Returns immediately. Prefetches are cancelled through the stop event of the context.
+    """
+    prefetches = []
+    with _prefetches_lock:
+        for url in dict.fromkeys(urls):
+            key = _document_key(context, url, "md")
+            if key in _prefetches or key in _documents:
+                continue
+            _prefetches[key] = _Prefetch()
+            prefetches.append((url, key, _prefetches[key]))
+    if prefetches:
+        engine.spawn(_prefetch(context, prefetches))
+    return len(prefetches)
+
+
+def _paginate(chunks: list[Chunk], page: int, what: str = "document"):
+    if len(chunks) == 1:
+        return chunks[0].text
+
+    if not 1 <= page <= len(chunks):
+        return f"Error: Page {page} does not exist, the {what} has {len(chunks)} pages."
+
+    return (
+        chunks[page - 1].text
+        + f"\n\n[... truncated, this is page {page} of {len(chunks)}"
+        + (f", next page: {page + 1}" if page < len(chunks) else "")
+        + ". Sections per page:\n"
+        + page_index(chunks, page, max_pages=MAX_INDEXED_PAGES)
+        + (
+            '\nNot all pages are listed, use format "toc" for the full table of contents.'
+            if len(chunks) > MAX_INDEXED_PAGES
+            else ""
+        )
+        + "\n...]"
+    )
+
+
+def _table_of_contents(document: _Document, section: str | None = None, page: int = 1):
+    if not document.sections:
+        return (
+            f"The document has no headings. It has {len(document.chunks)} page(s)"
+            f" of about {PAGE_TOKENS:,} tokens."
+        )
+
+    # Sections are in the same order as the headings in the chunks
+    pages = [
+        page for page, chunk in enumerate(document.chunks, 1) for _ in chunk.headings
+    ]
+    if len(pages) != len(document.sections):
+        pages = []
+
+    sections = list(enumerate(document.sections))
+    title = "Table of contents"
+    if section:
+        found = find_section(document.sections, section)
+        if found is None:
+            return f'Error: Section {section} not found. Use format "toc" without section to see the available sections.'
+        sections = [(i, s) for i, s in sections if found.start <= s.start < found.end]
+        title = f"Table of contents of #{found.anchors[0]}"
+
+    top_level = min(s.level for _, s in sections)
+
+    def toc_lines(max_level: int):
+        # Sections deeper than max_level are left out, and counted as subsections of the section they're in
+        entries: list[tuple[str, list[str], int]] = []
+        end = -1
+        for i, s in sections:
+            if s.level > max_level:
+                if entries and s.start < end:
+                    entries[-1] = (*entries[-1][:2], entries[-1][2] + 1)
+                continue
+            details = [f"#{s.anchors[0]}"]
+            if pages:
+                details.append(f"page {pages[i]}")
+            details.append(
+                f"~{estimate_tokens(document.content[s.start : s.end]):,} tokens"
+            )
+            entries.append(("  " * (s.level - top_level) + f"- {s.title}", details, 0))
+            end = s.end
+        return [
+            f"{prefix} ({', '.join(details + ([f'{n} subsections'] if n else []))})"
+            for prefix, details, n in entries
+        ]
+
+    # Keep the table of contents within the size of a page, by leaving out the deepest levels first,
+    # but not down to a single entry (e.g. just the title of the page)
+    deepest = max_level = max(s.level for _, s in sections)
+    min_level = top_level
+    while min_level < deepest and sum(s.level <= min_level for _, s in sections) < 2:
+        min_level += 1
+    lines = toc_lines(max_level)
+    while max_level > min_level and estimate_tokens("\n".join(lines)) > PAGE_TOKENS:
+        max_level -= 1
+        lines = toc_lines(max_level)
+
+    # If it's still too large, it's split into pages
+    toc_pages: list[list[str]] = [[]]
+    size = 0
+    for line in lines:
+        if toc_pages[-1] and size + estimate_tokens(line) > PAGE_TOKENS:
+            toc_pages.append([])
+            size = 0
+        toc_pages[-1].append(line)
+        size += estimate_tokens(line)
+    if not 1 <= page <= len(toc_pages):
+        return f"Error: Page {page} does not exist, the table of contents has {len(toc_pages)} pages."
+
+    result = [
+        f"{title} ({len(document.chunks)} page(s) of about {PAGE_TOKENS:,} tokens):",
+        *toc_pages[page - 1],
+    ]
+    if max_level < deepest:
+        result.append(
+            f'[Headings below h{max_level} are left out, use format "toc" with a section to see its subsections]'
+        )
+    if len(toc_pages) > 1:
+        result.append(
+            f"[... truncated, this is page {page} of {len(toc_pages)} of the table of contents"
+            + (f", next page: {page + 1}" if page < len(toc_pages) else "")
+            + " ...]"
+        )
+    return "\n".join(result)
+
+
+def _fetch_section(document: _Document, section: str, page: int):
+    if not document.sections:
+        return "Error: The document has no headings, so it has no sections to request. Use page instead."
+
+    found = find_section(document.sections, section)
+    if found is None:
+        available = ", ".join(f"#{s.anchors[0]}" for s in document.sections[:50])
+        return f"Error: Section {section} not found. Available sections: {available}"
+
+    chunks = chunk_markdown(document.content[found.start : found.end], PAGE_TOKENS)
+    return _paginate(chunks, page, what="section")
+
+
+def _fetch(
+    context: AgentContext,
+    url: str,
+    page: int,
+    format: str,
+    deadline_at: float | None = None,
+    section: str | None = None,
+):
+    try:
+        if format == "toc":
+            return _table_of_contents(
+                _load_document(context, url, "md", deadline_at), section, page
+            )
+
+        if section and format == "html":
+            return (
+                'Error: Sections can only be requested in the "md" or "article" format.'
+            )
+
+        document = _load_document(context, url, format, deadline_at)
+
+        if section:
+            return _fetch_section(document, section, page)
+
+        return _paginate(document.chunks, page)
+    except _FetchError as e:
+        return str(e)
+    except Exception as e:
+        return f"Error fetching or processing URL: {str(e)}"
+
+
+def _record_pool_stats(context: AgentContext):
+    # Compact summary of the shared connection pool, e.g. to see whether connections are reused
+    stats = http_client.pool_stats()
+    pools = stats["pools"]
+    context.tracer.current_trace.add_attribute(
+        "ai.tool.http_pool",
+        f"sessions={stats['sessions']} sessions_closed={stats['sessions_closed']} "
+        f"pools={len(pools)} "
+        f"connections_opened={sum(pool['connections_opened'] for pool in pools)} "
+        f"idle_connections={sum(pool['idle_connections'] for pool in pools)} "
+        f"requests={sum(pool['requests'] for pool in pools)}",
+    )
 
 
 @registry.tool(tool_registry=web_research)
-def fetch_html(url: str, page: int = 1, format: str = "md"):
+def fetch_html(url: str, page: int = 1, format: str = "md", section: str | None = None):
     """
     Fetch a web page and return it in either markdown (default) or raw HTML format.
 
-    Output will be truncated to max 10,000 characters.
+    Use format "article" to get just the main content of the page as markdown, without navigation, banners, footers, sidebars, etc.
+    That's usually what you want for articles, blog posts and documentation pages.
+
+    Long documents are split into pages of a few thousand tokens (configurable), at section boundaries where possible.
+    The first page is returned, along with a list of the sections on each page, so you can request the page you need.
+    To find your way in a long page, use format "toc" to get just its table of contents, with the anchor, page and size of each section.
+    Then request the section you need directly, e.g. section="#installation", rather than walking through the pages.
+    For very long documents the table of contents leaves out the deepest headings; use format "toc" with a section to see its subsections.
 
     This tool works on HTML and XHTML pages.
 
@@ -46,93 +615,95 @@ def fetch_html(url: str, page: int = 1, format: str = "md"):
     url : str
         The URL to fetch, e.g.: https://example.org, https://example.org/path/to, https://example.org/path/to/file.html
     page : int
-        The next page nr to request, in case the previous request was truncated.
+        The page nr to request, in case the previous request was truncated. If a section is requested, the page within that section.
+        For format "toc", the page of the table of contents.
     format : str, optional
-        The return format, either "md" or "html", default "md"
+        The return format, either "md", "article", "html" or "toc" (table of contents only), default "md"
+    section : str, optional
+        The section to return, by anchor or heading, e.g. "#installation" or "Installation". Default: the whole page.
+        For format "toc", the section to return the table of contents of.
     """
-    # Add comprehensive browser-like headers to avoid bot detection
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Referer": "https://www.google.com/",
-        "DNT": "1",  # Do Not Track
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-User": "?1",
-        "Sec-Ch-Ua": '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-        "Sec-Ch-Ua-Mobile": "?0",
-        "Sec-Ch-Ua-Platform": '"Windows"',
-    }
-
     context = AgentContext.current()
-    try:
 
-        session = get_session(
-            context.auth_context["principal_id"], context.conversation_id
+    try:
+        return engine.run(
+            _host_limiter.run(
+                _host(url),
+                context.copy_context().run,
+                functools.partial(_fetch, context, url, page, format, section=section),
+            )
         )
-        response = session.get(url, headers=headers, allow_redirects=True, timeout=30.0)
-        content_type = response.headers.get("Content-Type", "")
+    finally:
+        _record_pool_stats(context)
 
-        # Improved content type checking - use regex to match base content type
-        if not (
-            re.search(r"text/html", content_type, re.I)
-            or re.search(r"application/xhtml\+xml", content_type, re.I)
-        ):
-            return f"Error: Unsupported content type: {content_type}. Cannot convert to markdown."
 
-        # Check if response content appears to be binary/non-text
-        try:
-            # Try to decode a sample of the content to check if it's text
-            sample = response.content[:1000]
-            sample.decode(response.encoding or "utf-8")
-        except UnicodeDecodeError:
-            return "Error: Content appears to be binary data, not text/HTML. Cannot convert to markdown."
-
-        # Get the text content with proper encoding
-        html_content = response.text
-
-        # Check if content is actually HTML (basic validation)
-        if not re.search(r"<html|<body|<div|<p|<h[1-6]|<!DOCTYPE", html_content, re.I):
-            return "Error: Content doesn't appear to be valid HTML. Cannot convert to markdown."
-
-        if format == "md":
-
-            content = markdownify(
-                _clean_html(html_content),
-                convert=[
-                    "a",
-                    "p",
-                    "h1",
-                    "h2",
-                    "h3",
-                    "h4",
-                    "h5",
-                    "h6",
-                    "ul",
-                    "ol",
-                    "li",
-                    "strong",
-                    "em",
-                    "blockquote",
-                    "img",
-                ],
-            )
+@registry.tool(tool_registry=web_research)
+def fetch_many_html(urls: list[str], format: str = "md", deadline: float = 60.0):
+    """
+    Fetch multiple web pages in parallel, and return each in either markdown (default) or raw HTML format.
 
-        else:
-            content = html_content
+    Favor this tool over multiple fetch_html calls, when you need to fetch several pages at once.
+    Pages that did not finish before the deadline are reported as errors, so a slow web site can't hold up the other pages.
 
-        if len(content) <= 10_000:
-            return content
+    Long documents are split into pages of a few thousand tokens (configurable); the first page is returned, use fetch_html to request other pages.
 
-        start_pos = (page - 1) * 10_000
-        return (
-            content[start_pos : start_pos + 10_000]
-            + f"\n\n[... truncated, next page: {page + 1} ...]"
-        )
-    except Exception as e:
-        return f"Error fetching or processing URL: {str(e)}"
+    Parameters
+    ------
+    urls : list[str]
+        The URLs to fetch, e.g.: ["https://example.org", "https://example.org/path/to"]
+    format : str, optional
+        The return format, either "md", "article" (main content only, as markdown), "html" or "toc" (table of contents only), default "md"
+    deadline : float, optional
+        Max nr of seconds to wait for all pages to be fetched, default 60
+    """
+    context = AgentContext.current()
+    current_trace = context.tracer.current_trace
+    deadline_at = time.monotonic() + deadline
+
+    urls = list(dict.fromkeys(urls))
+    fetched: list[int] = []
+
+    def on_done(i: int, _):
+        fetched.append(i)
+        current_trace.add_attribute("ai.tool.fetched", f"{len(fetched)}/{len(urls)}")
+        current_trace.emit_snapshot()
+
+    results = {
+        urls[i]: content
+        for i, content in engine.run_all(
+            [
+                functools.partial(
+                    context.copy_context().run,
+                    _fetch,
+                    context,
+                    url,
+                    1,
+                    format,
+                    deadline_at,
+                )
+                for url in urls
+            ],
+            limit=MAX_PARALLEL_FETCHES,
+            deadline_at=deadline_at,
+            stop_event=context.stop_event,
+            on_done=on_done,
+            host_limiter=_host_limiter,
+            hosts=[_host(url) for url in urls],
+        ).items()
+    }
+
+    _record_pool_stats(context)
+    return [
+        {
+            "url": url,
+            "content": results.get(
+                url,
+                (
+                    "Error: Aborted due to stop event"
+                    if context.stop_event.is_set()
+                    else f"Error: Deadline of {deadline:.0f} seconds exceeded"
+                ),
+            ),
+        }
+        for url in urls
+    ]
@@ -1,16 +1,107 @@
+import asyncio
+import functools
 import json
-import os
 import re
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from dataclasses import dataclass
 
 import requests
 import yaml
 from generative_ai_toolkit.agent import registry
+from generative_ai_toolkit.context import AgentContext
 
+from tools import engine, github_client, github_snapshot
 from tools.registries import web_research
 
+# Max nr of requests of one fetch_pr_data_yaml call that are in flight at the same time
+MAX_PARALLEL_REQUESTS = 8
+
+# Page size of paginated list requests (the max GitHub allows)
+PER_PAGE = 100
+
+# Max nr of repository trees (file indexes, per commit SHA) that are kept in memory
+MAX_TREE_INDEXES = 32
+
+# Max nr of PR snapshots (for incremental refreshes) that are kept, over all conversations
+MAX_PR_SNAPSHOTS = 256
+
+# All PR data in one query. Connections that have more items are paginated by running the query again
+# with their cursor, while the connections that are complete are left out (@include).
+# GitHub rejects queries that could return more than 500,000 nodes, so the nested connections are kept small:
+# this query is at most 31,421 nodes (the check suites, with their check runs and steps, account for 21,020)
+_PR_QUERY = """
+query (
+  $owner: String!, $repo: String!, $number: Int!, $firstPage: Boolean!,
+  $comments: Boolean!, $commentsCursor: String,
+  $threads: Boolean!, $threadsCursor: String,
+  $files: Boolean!, $filesCursor: String,
+  $contexts: Boolean!, $contextsCursor: String
+) {
+  rateLimit { cost nodeCount }
+  repository(owner: $owner, name: $repo) {
+    pullRequest(number: $number) {
+      title body state merged mergeable mergeStateStatus isDraft
+      createdAt updatedAt mergedAt closedAt
+      comments(first: 100, after: $commentsCursor) @include(if: $comments) {
+        pageInfo { hasNextPage endCursor }
+        nodes { author { login } createdAt body }
+      }
+      reviewThreads(first: 100, after: $threadsCursor) @include(if: $threads) {
+        pageInfo { hasNextPage endCursor }
+        nodes { comments(first: 100) { nodes { author { login } createdAt body } } }
+      }
+      files(first: 100, after: $filesCursor) @include(if: $files) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path additions deletions changeType }
+      }
+      commits(last: 1) {
+        nodes {
+          commit {
+            checkSuites(first: 20) @include(if: $firstPage) {
+              pageInfo { hasNextPage }
+              nodes {
+                status conclusion
+                workflowRun {
+                  databaseId runNumber url createdAt updatedAt
+                  workflow { name }
+                  file { path }
+                }
+                checkRuns(first: 50) {
+                  pageInfo { hasNextPage }
+                  nodes {
+                    name status conclusion startedAt completedAt
+                    steps(first: 20) { nodes { name status conclusion number } }
+                  }
+                }
+              }
+            }
+            statusCheckRollup {
+              state
+              contexts(first: 100, after: $contextsCursor) @include(if: $contexts) {
+                pageInfo { hasNextPage endCursor }
+                nodes {
+                  __typename
+                  ... on CheckRun { name status conclusion startedAt completedAt url }
+                  ... on StatusContext { context state description targetUrl createdAt }
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
 
 @registry.tool(tool_registry=web_research)
-def fetch_github_file(repo_url: str, file_path: str, branch: str | None = None) -> str:
+def fetch_github_file(
+    repo_url: str, file_path: str, branch: str | None = None, snapshot: bool = False
+) -> str:
     """
     Fetches the content of a specified file from a repository on GitHub.
 
@@ -22,6 +113,9 @@ def fetch_github_file(repo_url: str, file_path: str, branch: str | None = None)
         The relative path to the file within the repo (e.g., README.md, src/main.py).
     branch : str, optional
         The branch name to use. If None, will use the default branch.
+    snapshot : bool, optional
+        Download the whole repository once, and read from that local snapshot, default False.
+        Use this when you'll read many files of the same repository.
     """
     # Normalize and validate repo URL
     match = re.match(r"https?://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$", repo_url)
@@ -29,21 +123,18 @@ def fetch_github_file(repo_url: str, file_path: str, branch: str | None = None)
         raise ValueError(f"Invalid GitHub repo URL: {repo_url}")
 
     user, repo = match.groups()
-    api_url = f"https://api.github.com/repos/{user}/{repo}"
-    headers = {"Accept": "application/vnd.github.v3+json"}
-    if "GITHUB_TOKEN" in os.environ:
-        headers["Authorization"] = f'token {os.environ["GITHUB_TOKEN"]}'
+    branch, sha = github_client.resolve_branch(user, repo, branch)
 
-    if branch is None:
-        resp = requests.get(api_url, headers=headers)
-        if resp.status_code != 200:
+    if snapshot:
+        content = _snapshot(user, repo, branch, sha).read(file_path)
+        if content is None:
             raise ValueError(
-                f"Unable to fetch repo metadata: HTTP {resp.status_code}, {resp.text}"
+                f"Unable to fetch file '{file_path}' on branch '{branch}': not found"
             )
-        branch = resp.json().get("default_branch", "main")
+        return content.decode("utf-8", errors="replace")
 
-    raw_url = f"https://raw.githubusercontent.com/{user}/{repo}/{branch}/{file_path}"
-    resp = requests.get(raw_url, headers=headers)
+    raw_url = f"{github_client.RAW_URL}/{user}/{repo}/{sha or branch}/{file_path}"
+    resp = github_client.get(raw_url, immutable=sha is not None)
 
     if resp.status_code != 200:
         raise ValueError(
@@ -56,7 +147,10 @@ def fetch_github_file(repo_url: str, file_path: str, branch: str | None = None)
 
 @registry.tool(tool_registry=web_research)
 def list_github_folder(
-    repo_url: str, folder_path: str = "", branch: str | None = None
+    repo_url: str,
+    folder_path: str = "",
+    branch: str | None = None,
+    snapshot: bool = False,
 ) -> list[dict]:
     """
     Lists the contents of a folder in a repository on GitHub.
@@ -69,28 +163,27 @@ def list_github_folder(
         Path to the folder inside the repo (e.g., "src", or "" for root).
     branch : str, optional
         Specific branch to use; defaults to the repo's default branch.
+    snapshot : bool, optional
+        Download the whole repository once, and list from that local snapshot, default False.
+        Use this when you'll explore many folders of the same repository. Returns compact entries (name, path, type, size).
     """
     match = re.match(r"https?://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$", repo_url)
     if not match:
         raise ValueError(f"Invalid GitHub repo URL: {repo_url}")
 
-    headers = {"Accept": "application/vnd.github.v3+json"}
-    if "GITHUB_TOKEN" in os.environ:
-        headers["Authorization"] = f'token {os.environ["GITHUB_TOKEN"]}'
-
     user, repo = match.groups()
-    if branch is None:
-        meta_resp = requests.get(
-            f"https://api.github.com/repos/{user}/{repo}", headers=headers
-        )
-        if meta_resp.status_code != 200:
+    branch, sha = github_client.resolve_branch(user, repo, branch)
+
+    if snapshot:
+        entries = _snapshot(user, repo, branch, sha).list_folder(folder_path)
+        if entries is None:
             raise ValueError(
-                f"Unable to fetch repo metadata: {meta_resp.status_code}, {meta_resp.text}"
+                f"Unable to list folder '{folder_path}' on branch '{branch}': not found"
             )
-        branch = meta_resp.json().get("default_branch", "main")
+        return entries
 
-    api_url = f"https://api.github.com/repos/{user}/{repo}/contents/{folder_path}?ref={branch}"
-    resp = requests.get(api_url, headers=headers)
+    api_url = f"{github_client.API_URL}/repos/{user}/{repo}/contents/{folder_path}?ref={sha or branch}"
+    resp = github_client.get(api_url, immutable=sha is not None)
 
     if resp.status_code != 200:
         raise ValueError(
@@ -101,9 +194,134 @@ def list_github_folder(
     return resp.json()
 
 
+@registry.tool(tool_registry=web_research)
+def find_github_files(
+    repo_url: str,
+    pattern: str = "**",
+    folder_path: str = "",
+    branch: str | None = None,
+    max_results: int = 500,
+) -> list[dict]:
+    """
+    Finds files in a repository on GitHub by glob pattern, searching all folders at once.
+    Returns the path and size (in bytes) of each matching file.
+
+    Parameters
+    ----------
+    repo_url : str
+        The URL of the GitHub repository.
+    pattern : str, optional
+        Glob pattern, relative to folder_path: * matches within a folder name, ** matches across folders.
+        E.g. "**/*.py" for all Python files, "*.md" for the Markdown files directly in folder_path. Default "**" (all files).
+    folder_path : str, optional
+        Only search inside this folder (e.g., "src"), default "" (the whole repository).
+    branch : str, optional
+        Specific branch to use; defaults to the repo's default branch.
+    max_results : int, optional
+        The max nr of files to return, default 500.
+    """
+    match = re.match(r"https?://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$", repo_url)
+    if not match:
+        raise ValueError(f"Invalid GitHub repo URL: {repo_url}")
+
+    user, repo = match.groups()
+    branch, sha = github_client.resolve_branch(user, repo, branch)
+    files, truncated = _tree(user, repo, branch, sha)
+
+    prefix = folder_path.strip("/") + "/" if folder_path.strip("/") else ""
+    regex = _glob_to_regex(pattern.lstrip("/"))
+    results: list[dict] = []
+    for path, size in files:
+        if path.startswith(prefix) and regex.fullmatch(path[len(prefix) :]):
+            if len(results) == max_results:
+                results.append(
+                    {
+                        "warning": f"More than {max_results} files match, narrow down the pattern"
+                    }
+                )
+                break
+            results.append({"path": path, "size": size})
+    if truncated:
+        results.append(
+            {
+                "warning": "The repository is too large to list completely, so results may be missing. "
+                "Use folder_path, or list_github_folder"
+            }
+        )
+    return results
+
+
+def _tree(user: str, repo: str, branch: str, sha: str | None):
+    """
+    The files (path, size) of a repository at a commit, and whether GitHub truncated the list
+    """
+    key = (user.lower(), repo.lower(), sha)
+    if sha is not None:
+        with _trees_lock:
+            if key in _trees:
+                _trees.move_to_end(key)
+                return _trees[key]
+
+    # The tree of a commit SHA never changes, so it is cached without revalidation
+    resp = github_client.get(
+        f"{github_client.API_URL}/repos/{user}/{repo}/git/trees/{sha or branch}",
+        params={"recursive": 1},
+        immutable=sha is not None,
+    )
+    if resp.status_code != 200:
+        raise ValueError(
+            f"Unable to list files on branch '{branch}': HTTP {resp.status_code}, {resp.text}"
+        )
+    data = resp.json()
+    tree = (
+        [
+            (entry["path"], entry.get("size", 0))
+            for entry in data.get("tree", [])
+            if entry.get("type") == "blob"
+        ],
+        data.get("truncated", False),
+    )
+    if sha is not None:
+        with _trees_lock:
+            _trees[key] = tree
+            while len(_trees) > MAX_TREE_INDEXES:
+                _trees.popitem(last=False)
+    return tree
+
+
+def _glob_to_regex(pattern: str):
+    # ** matches across folders, * and ? within a folder name
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            characters = pattern[i + 1 : end]
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            regex += "[" + characters + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex)
+
+
 @registry.tool(tool_registry=web_research)
 def fetch_github_notebook(
-    repo_url: str, file_path: str, branch: str | None = None
+    repo_url: str, file_path: str, branch: str | None = None, snapshot: bool = False
 ) -> str:
     """
     Fetches a Jupyter notebook (.ipynb) from a repository on GitHub.
@@ -119,6 +337,9 @@ def fetch_github_notebook(
         The relative path to the notebook within the repo (e.g., notebooks/example.ipynb).
     branch : str, optional
         The branch name to use. If None, will use the default branch.
+    snapshot : bool, optional
+        Download the whole repository once, and read from that local snapshot, default False.
+        Use this when you'll read many files of the same repository.
     """
     # Normalize and validate repo URL
     match = re.match(r"https?://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$", repo_url)
@@ -129,33 +350,30 @@ def fetch_github_notebook(
     if not file_path.endswith(".ipynb"):
         raise ValueError(f"File must be a Jupyter notebook (.ipynb): {file_path}")
 
-    headers = {"Accept": "application/vnd.github.v3+json"}
-    if "GITHUB_TOKEN" in os.environ:
-        headers["Authorization"] = f'token {os.environ["GITHUB_TOKEN"]}'
-
     user, repo = match.groups()
-    api_url = f"https://api.github.com/repos/{user}/{repo}"
+    branch, sha = github_client.resolve_branch(user, repo, branch)
 
-    if branch is None:
-        resp = requests.get(api_url, headers=headers)
-        if resp.status_code != 200:
+    if snapshot:
+        content = _snapshot(user, repo, branch, sha).read(file_path)
+        if content is None:
             raise ValueError(
-                f"Unable to fetch repo metadata: HTTP {resp.status_code}, {resp.text}"
+                f"Unable to fetch notebook '{file_path}' on branch '{branch}': not found"
             )
-        branch = resp.json().get("default_branch", "main")
-
-    raw_url = f"https://raw.githubusercontent.com/{user}/{repo}/{branch}/{file_path}"
-    resp = requests.get(raw_url, headers=headers)
+        text = content.decode("utf-8", errors="replace")
+    else:
+        raw_url = f"{github_client.RAW_URL}/{user}/{repo}/{sha or branch}/{file_path}"
+        resp = github_client.get(raw_url, immutable=sha is not None)
 
-    if resp.status_code != 200:
-        raise ValueError(
-            f"Unable to fetch notebook '{file_path}' on branch '{branch}': "
-            f"HTTP {resp.status_code}, {resp.text}"
-        )
+        if resp.status_code != 200:
+            raise ValueError(
+                f"Unable to fetch notebook '{file_path}' on branch '{branch}': "
+                f"HTTP {resp.status_code}, {resp.text}"
+            )
+        text = resp.text
 
     try:
         # Parse the notebook JSON
-        notebook = json.loads(resp.text)
+        notebook = json.loads(text)
 
         # Remove outputs from all cells
         if "cells" in notebook:
@@ -172,41 +390,590 @@ def fetch_github_notebook(
         raise ValueError(f"The file '{file_path}' is not a valid Jupyter notebook.")
 
 
+def _snapshot(user: str, repo: str, branch: str, sha: str | None):
+    if sha is None:
+        raise ValueError(f"Unable to resolve branch '{branch}' to a commit")
+    return github_snapshot.get(user, repo, sha)
+
+
+def _parse_pr_url(pr_url: str):
+    m = re.match(
+        r"https://github\.com/(?P<owner>[^/]+)/(?P<repo>[^/]+)/pull/(?P<number>\d+)",
+        pr_url,
+    )
+    if not m:
+        raise ValueError(f"Invalid GitHub PR URL: {pr_url}")
+    return m.group("owner"), m.group("repo"), m.group("number")
+
+
+def _get_json(url: str, **kwargs):
+    resp = github_client.get(url, **kwargs)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _get_page(url: str, params: dict | None):
+    resp = github_client.get(url, params=params)
+    resp.raise_for_status()
+    return resp.json(), resp.links
+
+
+def _get_diff(pr_api_url: str):
+    resp = github_client.get(pr_api_url, accept="application/vnd.github.v3.diff")
+    resp.raise_for_status()
+    return resp.text
+
+
+def _file_info(file: dict):
+    info = {
+        "path": file.get("filename"),
+        "change": file.get("status"),
+        "additions": file.get("additions"),
+        "deletions": file.get("deletions"),
+    }
+    if file.get("previous_filename"):
+        info["previous_path"] = file["previous_filename"]
+    return info
+
+
+@dataclass
+class _PRSnapshot:
+    """
+    What a conversation last saw of a PR (REST mode), so that a refresh only fetches what changed
+    """
+
+    payload: dict
+    head_sha: str
+    issue_comments: dict  # by comment id
+    review_comments: dict  # by comment id
+    issue_comments_since: str | None  # the max updated_at seen, for the since parameter
+    review_comments_since: str | None
+    checks_completed: bool  # whether all workflow runs and checks had completed
+
+
+_trees: OrderedDict[tuple[str, str, str], tuple[list[tuple[str, int]], bool]] = (
+    OrderedDict()
+)
+_trees_lock = threading.Lock()
+
+_pr_snapshots: OrderedDict[tuple, _PRSnapshot] = OrderedDict()
+_pr_snapshots_lock = threading.Lock()
+
+
+class _Requests:
+    """
+    Runs the GitHub requests of a tool call concurrently on the engine, at most MAX_PARALLEL_REQUESTS at a time,
+    and records the duration of each request as a trace attribute
+    """
+
+    def __init__(self, max_items: int | None = None):
+        self.max_items = max_items
+        self.truncated: list[str] = []  # the lists that were cut off at max_items
+        self._context = AgentContext.current()
+        self._semaphore = asyncio.Semaphore(MAX_PARALLEL_REQUESTS)
+
+    async def timed(self, name: str, fn, *args, **kwargs):
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                return await engine.to_thread(
+                    self._context.copy_context().run,
+                    functools.partial(fn, *args, **kwargs),
+                )
+            finally:
+                self._context.tracer.current_trace.add_attribute(
+                    f"ai.tool.timing.{name}",
+                    round((time.perf_counter() - started) * 1000),
+                )
+
+    async def get_all(
+        self,
+        name: str,
+        url: str,
+        item_key: str | None = None,
+        params: dict | None = None,
+    ):
+        """
+        Fetch all pages of a list (up to max_items), following the Link headers. Once the first page tells
+        the number of the last page, the pages in between are fetched in parallel
+        """
+
+        def items_of(data):
+            return data if item_key is None else data.get(item_key, [])
+
+        max_items = self.max_items
+        params = {**(params or {}), "per_page": PER_PAGE}
+        data, links = await self.timed(name, _get_page, url, params)
+        items = items_of(data)
+        max_pages = -(-max_items // PER_PAGE) if max_items is not None else float("inf")
+        if "last" in links:
+            query = urllib.parse.parse_qs(
+                urllib.parse.urlsplit(links["last"]["url"]).query
+            )
+            last_page = int(query.get("page", ["1"])[0])
+            pages = await asyncio.gather(
+                *(
+                    self.timed(
+                        f"{name}.page{page}",
+                        _get_page,
+                        url,
+                        {**params, "page": page},
+                    )
+                    for page in range(2, int(min(last_page, max_pages)) + 1)
+                )
+            )
+            for data, _ in pages:
+                items.extend(items_of(data))
+            more = last_page > max_pages
+        else:
+            page = 1
+            while "next" in links and page < max_pages:
+                page += 1
+                data, links = await self.timed(
+                    f"{name}.page{page}", _get_page, links["next"]["url"], None
+                )
+                items.extend(items_of(data))
+            more = "next" in links
+        if more or (max_items is not None and len(items) > max_items):
+            self.truncated.append(name)
+        return items[:max_items]
+
+
 @registry.tool(tool_registry=web_research)
-def fetch_pr_data_yaml(pr_url: str) -> str:
+def fetch_pr_data_yaml(
+    pr_url: str,
+    max_items: int | None = 1000,
+    mode: str = "rest",
+    include_diff: bool = False,
+    refresh: bool = False,
+) -> str:
     """
     Given a GitHub pull request URL, returns a YAML string with:
       comments: list of all issue & review comments
-      diff: the raw unified diff string
+      files: the changed files, with their nr of additions and deletions (use fetch_pr_file_patch to see the changes)
+      diff: the raw unified diff string (only if include_diff is True)
       status: PR status information (state, merged, etc.)
       workflows: CI/CD workflow runs and their status/logs
+      truncated: the lists that were cut off at max_items (only present if any)
+      changes: what changed since the previous fetch of the PR in this conversation (only present if refresh is True)
 
     Parameters
     ---
     pr_url : str
       The PR URL
+    max_items : int, optional
+      The max nr of items to fetch per list (issue comments, review comments, jobs per workflow run, check runs),
+      default 1000. Use None to fetch all items.
+    mode : str, optional
+      "rest" (default) or "graphql". The "graphql" mode gets everything in one (paginated) GraphQL query,
+      which is faster and uses less of the rate limit, but requires a GITHUB_TOKEN.
+      In this mode the workflow runs come without logs_available.
+    include_diff : bool, optional
+      Include the full unified diff of the PR, default False. The diff can be huge, prefer fetch_pr_file_patch
+      for the files you want to review.
+    refresh : bool, optional
+      Re-check a PR that was fetched before in this conversation, e.g. after new commits were pushed, default False.
+      Only what changed is fetched (new comments; files, diff and workflow runs if the head commit moved), and
+      returned under changes, along with the complete updated data. Empty changes means nothing changed.
+      If there is no previous (REST mode) fetch to compare against, changes is null and the data is fetched completely.
+      Refreshes use the REST API, regardless of mode.
     """
-    m = re.match(
-        r"https://github\.com/(?P<owner>[^/]+)/(?P<repo>[^/]+)/pull/(?P<number>\d+)",
-        pr_url,
+    owner, repo, number = _parse_pr_url(pr_url)
+    if mode not in ("rest", "graphql"):
+        raise ValueError(f"Invalid mode: {mode}, use 'rest' or 'graphql'")
+    if mode == "graphql" and not refresh:
+        payload = _pr_data_graphql(owner, repo, int(number), max_items, include_diff)
+    else:
+        payload = _pr_data_rest(owner, repo, number, max_items, include_diff, refresh)
+    return yaml.safe_dump(payload, sort_keys=False)
+
+
+@registry.tool(tool_registry=web_research)
+def fetch_pr_file_patch(
+    pr_url: str, paths: list[str], hunks: list[int] | None = None
+) -> str:
+    """
+    Fetches the patch (unified diff) of chosen files of a GitHub pull request.
+    Use fetch_pr_data_yaml first, to see which files were changed.
+
+    Parameters
+    ---
+    pr_url : str
+      The PR URL
+    paths : list[str]
+      The paths of the files, as listed under files by fetch_pr_data_yaml
+    hunks : list[int], optional
+      Only return these hunks of each file, numbered from 1 in order of their @@ headers. By default all hunks are returned.
+    """
+    owner, repo, number = _parse_pr_url(pr_url)
+    files = engine.run(
+        _Requests().get_all(
+            "files",
+            f"{github_client.API_URL}/repos/{owner}/{repo}/pulls/{number}/files",
+        )
     )
-    if not m:
-        raise ValueError(f"Invalid GitHub PR URL: {pr_url}")
-    owner, repo, number = m.group("owner"), m.group("repo"), m.group("number")
+    files_by_path = {file.get("filename"): file for file in files}
+    patches = []
+    for path in paths:
+        file = files_by_path.get(path)
+        if file is None:
+            patches.append(f"{path}: not changed in this pull request")
+            continue
+        header = f"diff --git a/{file.get('previous_filename', path)} b/{path}"
+        patch = file.get("patch")
+        if patch is None:
+            patches.append(
+                f"{header}\n(no patch available: binary file, or the diff is too large)"
+            )
+            continue
+        file_hunks = [hunk for hunk in re.split(r"(?m)^(?=@@ )", patch) if hunk]
+        selected = [
+            file_hunks[i - 1] for i in (hunks or []) if 0 < i <= len(file_hunks)
+        ]
+        patches.append(
+            "\n".join(
+                [
+                    f"{header} ({file.get('status')}, +{file.get('additions')} -{file.get('deletions')}, "
+                    f"{len(file_hunks)} hunks)",
+                    *(selected if hunks else file_hunks),
+                ]
+            )
+        )
+    return "\n\n".join(patches)
 
-    headers = {"Accept": "application/vnd.github.v3+json"}
-    if "GITHUB_TOKEN" in os.environ:
-        headers["Authorization"] = f'token {os.environ["GITHUB_TOKEN"]}'
 
-    # 1) Fetch PR metadata (title, description, and status info)
-    meta_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{number}"
-    resp = requests.get(meta_url, headers=headers)
-    resp.raise_for_status()
-    pr_meta = resp.json()
+def _pr_data_graphql(
+    owner: str, repo: str, number: int, max_items: int | None, include_diff: bool
+):
+    current_trace = AgentContext.current().tracer.current_trace
+
+    def lower(value):
+        return value.lower() if isinstance(value, str) else value
+
+    # The paginated connections, by the name they have in the output's truncated list
+    connections = {
+        "comments": "issue_comments",
+        "threads": "review_comments",
+        "files": "files",
+        "contexts": "check_runs",
+    }
+    nodes: dict[str, list] = {name: [] for name in connections}
+    variables = {"owner": owner, "repo": repo, "number": number, "firstPage": True}
+    variables.update({name: True for name in connections})
+    truncated = []
+    pr = commit = rollup = None
+    page = 0
+    while page == 0 or any(variables[name] for name in connections):
+        page += 1
+        started = time.perf_counter()
+        data = github_client.graphql(_PR_QUERY, variables)
+        current_trace.add_attribute(
+            f"ai.tool.timing.graphql.page{page}",
+            round((time.perf_counter() - started) * 1000),
+        )
+        rate_limit = data.get("rateLimit") or {}
+        current_trace.add_attribute(
+            f"ai.tool.graphql.page{page}.cost", rate_limit.get("cost")
+        )
+        current_trace.add_attribute(
+            f"ai.tool.graphql.page{page}.node_count", rate_limit.get("nodeCount")
+        )
+        pull = (data.get("repository") or {}).get("pullRequest")
+        if pull is None:
+            raise ValueError(f"Pull request not found: {owner}/{repo}#{number}")
+        commits = pull["commits"]["nodes"]
+        page_rollup = commits[0]["commit"]["statusCheckRollup"] if commits else None
+        if page == 1:
+            pr = pull
+            commit = commits[0]["commit"] if commits else {}
+            rollup = page_rollup
+        page_connections = {
+            "comments": pull.get("comments"),
+            "threads": pull.get("reviewThreads"),
+            "files": pull.get("files"),
+            "contexts": page_rollup and page_rollup.get("contexts"),
+        }
+        variables["firstPage"] = False
+        for name, connection in page_connections.items():
+            if not variables[name]:
+                continue
+            if not connection:
+                variables[name] = False
+                continue
+            nodes[name].extend(connection["nodes"])
+            more = connection["pageInfo"]["hasNextPage"]
+            if more and max_items is not None and len(nodes[name]) >= max_items:
+                truncated.append(connections[name])
+                more = False
+            variables[name] = more
+            variables[f"{name}Cursor"] = connection["pageInfo"]["endCursor"]
+
+    def simplify(comments):
+        return [
+            {
+                "who": (c.get("author") or {}).get("login", ""),
+                "when": c.get("createdAt", ""),
+                "body": c.get("body", ""),
+            }
+            for c in comments[:max_items]
+        ]
+
+    review_comments = [
+        comment
+        for thread in nodes["threads"]
+        for comment in thread["comments"]["nodes"]
+    ]
+
+    # Check suites and their check runs aren't paginated, to keep the query small
+    check_suites = commit.get("checkSuites") or {}
+    if check_suites.get("pageInfo", {}).get("hasNextPage"):
+        truncated.append("workflows")
+    workflows_info = []
+    for suite in check_suites.get("nodes", []):
+        run = suite.get("workflowRun")
+        if not run:
+            continue  # Not a GitHub Actions check suite
+        if suite["checkRuns"].get("pageInfo", {}).get("hasNextPage"):
+            truncated.append(f"jobs.{run.get('databaseId')}")
+        workflows_info.append(
+            {
+                "id": run.get("databaseId"),
+                "name": (run.get("workflow") or {}).get("name"),
+                "status": lower(suite.get("status")),
+                "conclusion": lower(suite.get("conclusion")),
+                "workflow_file": ((run.get("file") or {}).get("path") or "").replace(
+                    ".github/workflows/", ""
+                ),
+                "created_at": run.get("createdAt"),
+                "updated_at": run.get("updatedAt"),
+                "run_number": run.get("runNumber"),
+                "html_url": run.get("url"),
+                "jobs": [
+                    {
+                        "name": job.get("name"),
+                        "status": lower(job.get("status")),
+                        "conclusion": lower(job.get("conclusion")),
+                        "started_at": job.get("startedAt"),
+                        "completed_at": job.get("completedAt"),
+                        "steps": [
+                            {
+                                "name": step.get("name"),
+                                "status": lower(step.get("status")),
+                                "conclusion": lower(step.get("conclusion")),
+                                "number": step.get("number"),
+                            }
+                            for step in job["steps"]["nodes"]
+                        ],
+                    }
+                    for job in suite["checkRuns"]["nodes"]
+                ],
+            }
+        )
+
+    contexts = nodes["contexts"][:max_items]
+    statuses = [c for c in contexts if c.get("__typename") == "StatusContext"]
+    status_checks = [
+        {
+            "overall": {
+                "state": lower((rollup or {}).get("state")),
+                "total_count": len(statuses),
+            }
+        }
+    ]
+    for status in statuses:
+        status_checks.append(
+            {
+                "context": status.get("context"),
+                "state": lower(status.get("state")),
+                "description": status.get("description"),
+                "target_url": status.get("targetUrl"),
+                "created_at": status.get("createdAt"),
+            }
+        )
+    for check in contexts:
+        if check.get("__typename") == "CheckRun":
+            status_checks.append(
+                {
+                    "name": check.get("name"),
+                    "status": lower(check.get("status")),
+                    "conclusion": lower(check.get("conclusion")),
+                    "started_at": check.get("startedAt"),
+                    "completed_at": check.get("completedAt"),
+                    "html_url": check.get("url"),
+                }
+            )
+
+    payload = {
+        "title": pr.get("title", ""),
+        "description": pr.get("body", ""),
+        "status": {
+            "state": "open" if pr.get("state") == "OPEN" else "closed",
+            "merged": pr.get("merged", False),
+            "mergeable": {"MERGEABLE": True, "CONFLICTING": False}.get(
+                pr.get("mergeable")
+            ),
+            "mergeable_state": lower(pr.get("mergeStateStatus", "")),
+            "draft": pr.get("isDraft", False),
+            "created_at": pr.get("createdAt", ""),
+            "updated_at": pr.get("updatedAt", ""),
+            "merged_at": pr.get("mergedAt"),
+            "closed_at": pr.get("closedAt"),
+        },
+        "comments": simplify(nodes["comments"]) + simplify(review_comments),
+        "files": [
+            {
+                "path": file.get("path"),
+                "change": lower(file.get("changeType")),
+                "additions": file.get("additions"),
+                "deletions": file.get("deletions"),
+            }
+            for file in nodes["files"][:max_items]
+        ],
+    }
+    if include_diff:
+        payload["diff"] = _get_diff(
+            f"{github_client.API_URL}/repos/{owner}/{repo}/pulls/{number}"
+        )
+    payload["workflows"] = workflows_info
+    payload["status_checks"] = status_checks
+    if truncated:
+        payload["truncated"] = sorted(truncated)
+    return payload
+
+
+def _pr_data_rest(
+    owner: str,
+    repo: str,
+    number: str,
+    max_items: int | None,
+    include_diff: bool,
+    refresh: bool,
+):
+    api_url = f"{github_client.API_URL}/repos/{owner}/{repo}"
+    meta_url = f"{api_url}/pulls/{number}"
+
+    requests_ = _Requests(max_items)
+    snapshot_key = (
+        AgentContext.current().conversation_id,
+        owner.lower(),
+        repo.lower(),
+        number,
+    )
+    with _pr_snapshots_lock:
+        previous = _pr_snapshots.get(snapshot_key) if refresh else None
+    # Placeholder for data that is reused from the previous snapshot
+    unchanged = object()
+
+    async def fetch():
+        timed, get_all = requests_.timed, requests_.get_all
+
+        async def fetch_workflows(head_sha: str):
+            runs_data = await timed(
+                "workflow_runs",
+                _get_json,
+                f"{api_url}/actions/runs",
+                params={"head_sha": head_sha, "per_page": 100},
+            )
+            runs = runs_data.get("workflow_runs", [])
+            failed_runs = [
+                run for run in runs if run.get("conclusion") in ["failure", "cancelled"]
+            ]
+            results = await asyncio.gather(
+                *(
+                    get_all(
+                        f"jobs.{run.get('id')}",
+                        f"{api_url}/actions/runs/{run.get('id')}/jobs",
+                        "jobs",
+                    )
+                    for run in runs
+                ),
+                *(
+                    timed(
+                        f"logs.{run.get('id')}",
+                        github_client.status,
+                        f"{api_url}/actions/runs/{run.get('id')}/logs",
+                    )
+                    for run in failed_runs
+                ),
+                return_exceptions=True,
+            )
+            jobs = results[: len(runs)]
+            logs = dict(zip((id(run) for run in failed_runs), results[len(runs) :]))
+            return [(run, job, logs.get(id(run))) for run, job in zip(runs, jobs)]
+
+        async def fetch_status_checks(head_sha: str):
+            return await asyncio.gather(
+                timed("status", _get_json, f"{api_url}/commits/{head_sha}/status"),
+                get_all(
+                    "check_runs",
+                    f"{api_url}/commits/{head_sha}/check-runs",
+                    "check_runs",
+                ),
+            )
+
+        def since(cursor: str | None):
+            return {"since": cursor} if cursor else None
+
+        pr_meta = await timed("pull_request", _get_json, meta_url)
+        head_sha = pr_meta.get("head", {}).get("sha", "")
+        # On a refresh, only the comments since the previous fetch are requested. The files, diff and
+        # workflow runs only change when the head moved, and the checks only while they're running
+        head_moved = previous is None or previous.head_sha != head_sha
+        checks_changed = head_moved or not previous.checks_completed
+        diff_changed = head_moved or "diff" not in previous.payload
+        return pr_meta, *await asyncio.gather(
+            get_all(
+                "issue_comments",
+                f"{api_url}/issues/{number}/comments",
+                params=since(previous and previous.issue_comments_since),
+            ),
+            get_all(
+                "review_comments",
+                f"{meta_url}/comments",
+                params=since(previous and previous.review_comments_since),
+            ),
+            (
+                get_all("files", f"{meta_url}/files")
+                if head_moved
+                else asyncio.sleep(0, unchanged)
+            ),
+            (
+                timed("diff", _get_diff, meta_url)
+                if include_diff and diff_changed
+                else asyncio.sleep(0, unchanged if include_diff else None)
+            ),
+            (
+                asyncio.sleep(0, unchanged)
+                if not checks_changed
+                else fetch_workflows(head_sha) if head_sha else asyncio.sleep(0, [])
+            ),
+            (
+                asyncio.sleep(0, unchanged)
+                if not checks_changed
+                else (
+                    fetch_status_checks(head_sha)
+                    if head_sha
+                    else asyncio.sleep(0, None)
+                )
+            ),
+            return_exceptions=True,
+        )
+
+    (
+        pr_meta,
+        issue_comments,
+        review_comments,
+        files,
+        diff_text,
+        workflows,
+        statuses,
+    ) = engine.run(fetch())
+    for result in (issue_comments, review_comments, files, diff_text):
+        if isinstance(result, BaseException):
+            raise result
 
     title = pr_meta.get("title", "")
     description = pr_meta.get("body", "")
-    head_sha = pr_meta.get("head", {}).get("sha", "")
 
     # Extract status information
     status_info = {
@@ -232,173 +999,225 @@ def fetch_pr_data_yaml(pr_url: str) -> str:
             for c in comments
         ]
 
-    # 2) Fetch issue comments
-    issue_comments_url = (
-        f"https://api.github.com/repos/{owner}/{repo}/issues/{number}/comments"
-    )
-    resp = requests.get(issue_comments_url, headers=headers)
-    resp.raise_for_status()
-    issue_comments = resp.json()
+    # Comments by id, so that comments that were edited since a previous fetch replace the old version
+    def by_id(comments, previous_comments):
+        merged = dict(previous_comments)
+        for c in comments:
+            merged[
+                c.get("id", (c.get("user", {}).get("login"), c.get("created_at")))
+            ] = simplify([c])[0]
+        return merged
 
-    # 3) Fetch review comments
-    review_comments_url = (
-        f"https://api.github.com/repos/{owner}/{repo}/pulls/{number}/comments"
-    )
-    resp = requests.get(review_comments_url, headers=headers)
-    resp.raise_for_status()
-    review_comments = resp.json()
+    def max_updated_at(comments, previous_since):
+        return max(
+            [c["updated_at"] for c in comments if c.get("updated_at")]
+            + ([previous_since] if previous_since else []),
+            default=None,
+        )
 
-    # 4) Fetch diff
-    diff_headers = headers.copy()
-    diff_headers["Accept"] = "application/vnd.github.v3.diff"
-    resp = requests.get(meta_url, headers=diff_headers)
-    resp.raise_for_status()
-    diff_text = resp.text
+    issue_comments_by_id = by_id(
+        issue_comments, previous.issue_comments if previous else {}
+    )
+    review_comments_by_id = by_id(
+        review_comments, previous.review_comments if previous else {}
+    )
 
-    # 5) Fetch workflow runs for the PR's head commit
+    # Workflow runs for the PR's head commit
     workflows_info = []
-    if head_sha:
-        try:
-            # Get workflow runs for the head commit
-            runs_url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs"
-            params = {"head_sha": head_sha, "per_page": 100}
-            resp = requests.get(runs_url, headers=headers, params=params)
-            resp.raise_for_status()
-            runs_data = resp.json()
-
-            for run in runs_data.get("workflow_runs", []):
-                workflow_info = {
-                    "id": run.get("id"),
-                    "name": run.get("name"),
-                    "status": run.get("status"),  # queued, in_progress, completed
-                    "conclusion": run.get(
-                        "conclusion"
-                    ),  # success, failure, cancelled, etc.
-                    "workflow_file": run.get("path", "").replace(
-                        ".github/workflows/", ""
-                    ),
-                    "created_at": run.get("created_at"),
-                    "updated_at": run.get("updated_at"),
-                    "run_number": run.get("run_number"),
-                    "html_url": run.get("html_url"),
-                }
+    if workflows is unchanged:
+        workflows_info = previous.payload["workflows"]
+    elif isinstance(workflows, requests.RequestException):
+        # If workflow fetching fails, continue without workflows
+        workflows_info = [{"error": f"Failed to fetch workflows: {str(workflows)}"}]
+    elif isinstance(workflows, BaseException):
+        raise workflows
+    else:
+        for run, jobs_data, logs_status in workflows:
+            workflow_info = {
+                "id": run.get("id"),
+                "name": run.get("name"),
+                "status": run.get("status"),  # queued, in_progress, completed
+                "conclusion": run.get(
+                    "conclusion"
+                ),  # success, failure, cancelled, etc.
+                "workflow_file": run.get("path", "").replace(".github/workflows/", ""),
+                "created_at": run.get("created_at"),
+                "updated_at": run.get("updated_at"),
+                "run_number": run.get("run_number"),
+                "html_url": run.get("html_url"),
+            }
 
-                # Fetch jobs for this workflow run to get more detailed status
-                jobs_url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs/{run.get('id')}/jobs"
-                try:
-                    jobs_resp = requests.get(jobs_url, headers=headers)
-                    jobs_resp.raise_for_status()
-                    jobs_data = jobs_resp.json()
-
-                    workflow_info["jobs"] = []
-                    for job in jobs_data.get("jobs", []):
-                        job_info = {
-                            "name": job.get("name"),
-                            "status": job.get("status"),
-                            "conclusion": job.get("conclusion"),
-                            "started_at": job.get("started_at"),
-                            "completed_at": job.get("completed_at"),
-                        }
-
-                        # Get job steps for more detail
-                        steps = []
-                        for step in job.get("steps", []):
-                            steps.append(
-                                {
-                                    "name": step.get("name"),
-                                    "status": step.get("status"),
-                                    "conclusion": step.get("conclusion"),
-                                    "number": step.get("number"),
-                                }
-                            )
-                        job_info["steps"] = steps
-                        workflow_info["jobs"].append(job_info)
-
-                except requests.RequestException:
-                    # If we can't fetch jobs, continue without them
-                    workflow_info["jobs"] = []
-
-                # Try to fetch logs summary (first few lines) for failed runs
-                if run.get("conclusion") in ["failure", "cancelled"]:
-                    try:
-                        logs_url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs/{run.get('id')}/logs"
-                        logs_resp = requests.get(logs_url, headers=headers)
-                        if logs_resp.status_code == 200:
-                            # Note: This returns a ZIP file, so we just note that logs are available
-                            workflow_info["logs_available"] = True
-                        else:
-                            workflow_info["logs_available"] = False
-                    except requests.RequestException:
-                        workflow_info["logs_available"] = False
-                else:
-                    workflow_info["logs_available"] = False
-
-                workflows_info.append(workflow_info)
-
-        except requests.RequestException as e:
-            # If workflow fetching fails, continue without workflows
-            workflows_info = [{"error": f"Failed to fetch workflows: {str(e)}"}]
-
-    # 6) Fetch status checks for the commit
-    status_checks = []
-    if head_sha:
-        try:
-            # Get status checks
-            status_url = (
-                f"https://api.github.com/repos/{owner}/{repo}/commits/{head_sha}/status"
-            )
-            resp = requests.get(status_url, headers=headers)
-            resp.raise_for_status()
-            status_data = resp.json()
+            # Jobs of this workflow run, for more detailed status
+            workflow_info["jobs"] = []
+            if isinstance(jobs_data, requests.RequestException):
+                pass  # If we can't fetch jobs, continue without them
+            elif isinstance(jobs_data, BaseException):
+                raise jobs_data
+            else:
+                for job in jobs_data:
+                    job_info = {
+                        "name": job.get("name"),
+                        "status": job.get("status"),
+                        "conclusion": job.get("conclusion"),
+                        "started_at": job.get("started_at"),
+                        "completed_at": job.get("completed_at"),
+                    }
 
-            overall_status = {
-                "state": status_data.get("state"),  # pending, success, error, failure
-                "total_count": status_data.get("total_count"),
-            }
+                    # Get job steps for more detail
+                    steps = []
+                    for step in job.get("steps", []):
+                        steps.append(
+                            {
+                                "name": step.get("name"),
+                                "status": step.get("status"),
+                                "conclusion": step.get("conclusion"),
+                                "number": step.get("number"),
+                            }
+                        )
+                    job_info["steps"] = steps
+                    workflow_info["jobs"].append(job_info)
 
-            status_checks.append({"overall": overall_status})
+            # Logs are only requested for failed runs. These redirect to a ZIP file, so we just note that logs are available
+            workflow_info["logs_available"] = logs_status in (200, 302)
 
-            # Get individual status checks
-            for status in status_data.get("statuses", []):
-                status_checks.append(
-                    {
-                        "context": status.get("context"),
-                        "state": status.get("state"),
-                        "description": status.get("description"),
-                        "target_url": status.get("target_url"),
-                        "created_at": status.get("created_at"),
-                    }
-                )
+            workflows_info.append(workflow_info)
+
+    # Status checks for the head commit
+    status_checks = []
+    if statuses is unchanged:
+        status_checks = previous.payload["status_checks"]
+    elif isinstance(statuses, requests.RequestException):
+        # If status checks fail, continue without them
+        status_checks = [{"error": "Failed to fetch status checks"}]
+    elif isinstance(statuses, BaseException):
+        raise statuses
+    elif statuses is not None:
+        status_data, check_runs_data = statuses
 
-            # Get check runs (newer status checks API)
-            check_runs_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{head_sha}/check-runs"
-            resp = requests.get(check_runs_url, headers=headers)
-            resp.raise_for_status()
-            check_runs_data = resp.json()
+        overall_status = {
+            "state": status_data.get("state"),  # pending, success, error, failure
+            "total_count": status_data.get("total_count"),
+        }
 
-            for check in check_runs_data.get("check_runs", []):
-                status_checks.append(
-                    {
-                        "name": check.get("name"),
-                        "status": check.get("status"),
-                        "conclusion": check.get("conclusion"),
-                        "started_at": check.get("started_at"),
-                        "completed_at": check.get("completed_at"),
-                        "html_url": check.get("html_url"),
-                    }
-                )
+        status_checks.append({"overall": overall_status})
 
-        except requests.RequestException:
-            # If status checks fail, continue without them
-            status_checks = [{"error": "Failed to fetch status checks"}]
+        # Individual status checks
+        for status in status_data.get("statuses", []):
+            status_checks.append(
+                {
+                    "context": status.get("context"),
+                    "state": status.get("state"),
+                    "description": status.get("description"),
+                    "target_url": status.get("target_url"),
+                    "created_at": status.get("created_at"),
+                }
+            )
+
+        # Check runs (newer status checks API)
+        for check in check_runs_data:
+            status_checks.append(
+                {
+                    "name": check.get("name"),
+                    "status": check.get("status"),
+                    "conclusion": check.get("conclusion"),
+                    "started_at": check.get("started_at"),
+                    "completed_at": check.get("completed_at"),
+                    "html_url": check.get("html_url"),
+                }
+            )
 
     payload = {
         "title": title,
         "description": description,
         "status": status_info,
-        "comments": simplify(issue_comments) + simplify(review_comments),
-        "diff": diff_text,
-        "workflows": workflows_info,
-        "status_checks": status_checks,
+        "comments": list(issue_comments_by_id.values())
+        + list(review_comments_by_id.values()),
+        "files": (
+            previous.payload["files"]
+            if files is unchanged
+            else [_file_info(file) for file in files]
+        ),
     }
-    return yaml.safe_dump(payload, sort_keys=False)
+    if diff_text is unchanged:
+        payload["diff"] = previous.payload["diff"]
+    elif diff_text is not None:
+        payload["diff"] = diff_text
+    payload["workflows"] = workflows_info
+    payload["status_checks"] = status_checks
+    if requests_.truncated:
+        payload["truncated"] = sorted(requests_.truncated)
+
+    snapshot = _PRSnapshot(
+        payload=payload,
+        head_sha=pr_meta.get("head", {}).get("sha", ""),
+        issue_comments=issue_comments_by_id,
+        review_comments=review_comments_by_id,
+        issue_comments_since=max_updated_at(
+            issue_comments, previous and previous.issue_comments_since
+        ),
+        review_comments_since=max_updated_at(
+            review_comments, previous and previous.review_comments_since
+        ),
+        checks_completed=all(
+            workflow.get("status") == "completed" for workflow in workflows_info
+        )
+        and all(
+            check.get("status", "completed") == "completed"
+            and check.get("overall", {}).get("state") != "pending"
+            and "error" not in check
+            for check in status_checks
+        ),
+    )
+    with _pr_snapshots_lock:
+        _pr_snapshots[snapshot_key] = snapshot
+        _pr_snapshots.move_to_end(snapshot_key)
+        while len(_pr_snapshots) > MAX_PR_SNAPSHOTS:
+            _pr_snapshots.popitem(last=False)
+
+    if not refresh:
+        return payload
+    if previous is None:
+        # E.g. the PR was fetched in "graphql" mode before, or the snapshot was evicted
+        return {
+            "changes": None,
+            "note": "There was no previous REST fetch of this PR in this conversation to compare against,"
+            " so this is a complete fetch",
+            **payload,
+        }
+    return {"changes": _pr_changes(previous, snapshot), **payload}
+
+
+def _pr_changes(previous: _PRSnapshot, current: _PRSnapshot):
+    """
+    What changed in a PR between two snapshots: new values of changed fields, and new or changed list items
+    """
+    before, after = previous.payload, current.payload
+    changes = {}
+    for key in ("title", "description"):
+        if before[key] != after[key]:
+            changes[key] = after[key]
+    status = {
+        field: {"from": before["status"].get(field), "to": value}
+        for field, value in after["status"].items()
+        if before["status"].get(field) != value
+    }
+    if status:
+        changes["status"] = status
+    comments = [
+        comment
+        for comments_by_id, previous_comments_by_id in (
+            (current.issue_comments, previous.issue_comments),
+            (current.review_comments, previous.review_comments),
+        )
+        for comment_id, comment in comments_by_id.items()
+        if previous_comments_by_id.get(comment_id) != comment
+    ]
+    if comments:
+        changes["comments"] = comments
+    if current.head_sha != previous.head_sha:
+        changes["head_sha"] = {"from": previous.head_sha, "to": current.head_sha}
+    for key in ("files", "workflows", "status_checks"):
+        items = [item for item in after[key] if item not in before[key]]
+        if items:
+            changes[key] = items
+    return changes
@@ -0,0 +1,251 @@
+"""
+Shared client for the GitHub REST API (and raw.githubusercontent.com), used by all GitHub tools.
+
+Requests go through the shared connection pool. Responses are kept in an on-disk cache with their ETag
+(or Last-Modified) and revalidated with a conditional request on reuse: GitHub answers 304 Not Modified
+for unchanged resources, which doesn't count against the rate limit.
+Identical requests that are in flight at the same time are coalesced.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from generative_ai_toolkit.context import AgentContext
+from requests.structures import CaseInsensitiveDict
+
+from tools.disk_cache import DiskCache
+from tools.http_client import api_session
+from tools.singleflight import SingleFlight
+
+API_URL = "https://api.github.com"
+RAW_URL = "https://raw.githubusercontent.com"
+GRAPHQL_URL = f"{API_URL}/graphql"
+DEFAULT_ACCEPT = "application/vnd.github.v3+json"
+
+CACHE_MAX_BYTES = int(
+    os.environ.get("RESEARCH_AGENT_GITHUB_CACHE_MAX_BYTES", 256 * 1024**2)
+)
+
+# Response headers that are kept in the cache
+STORED_HEADERS = ["Content-Type", "ETag", "Last-Modified", "Link"]
+
+# How long repository metadata (e.g. the default branch) is reused
+REPO_METADATA_TTL = float(os.environ.get("RESEARCH_AGENT_GITHUB_REPO_TTL", 3600))
+
+# Max nr of repositories whose metadata is kept in memory, and max nr of resolved branches (over all conversations)
+MAX_REPO_METADATA = 1024
+MAX_RESOLVED_REFS = 4096
+
+_cache = DiskCache("github", max_bytes=CACHE_MAX_BYTES)
+_flight = SingleFlight()
+_repos: OrderedDict[tuple[str, str], tuple[float, dict]] = OrderedDict()
+_repos_lock = threading.Lock()
+_refs: OrderedDict[tuple, str | None] = OrderedDict()
+_refs_lock = threading.Lock()
+
+
+def _token():
+    return os.environ.get("GITHUB_TOKEN")
+
+
+def headers(accept: str = DEFAULT_ACCEPT):
+    headers = {"Accept": accept}
+    if token := _token():
+        headers["Authorization"] = f"token {token}"
+    return headers
+
+
+def _cache_key(url: str, accept: str, params: dict | None):
+    # Responses differ per token (e.g. private repositories), so the token is part of the key (hashed)
+    token = _token()
+    return "\n".join(
+        [
+            url,
+            "&".join(f"{k}={v}" for k, v in sorted((params or {}).items())),
+            accept,
+            hashlib.sha256(token.encode()).hexdigest()[:16] if token else "",
+        ]
+    )
+
+
+def _cached_response(url: str, meta: dict, body: bytes):
+    response = requests.Response()
+    response.url = meta.get("url", url)
+    response.status_code = 200
+    response.headers = CaseInsensitiveDict(meta["headers"])
+    response._content = body
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+def _get(url: str, accept: str, params: dict | None, timeout: float, immutable: bool):
+    key = _cache_key(url, accept, params)
+    cached = _cache.get(key)
+    if cached and immutable:
+        return _cached_response(url, *cached)
+    request_headers = headers(accept)
+    if cached:
+        meta, _ = cached
+        if "ETag" in meta["headers"]:
+            request_headers["If-None-Match"] = meta["headers"]["ETag"]
+        if "Last-Modified" in meta["headers"]:
+            request_headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+
+    response = api_session.get(
+        url, headers=request_headers, params=params, timeout=timeout
+    )
+    if cached and response.status_code == 304:
+        return _cached_response(url, *cached)
+
+    if response.status_code == 200 and (
+        immutable or "ETag" in response.headers or "Last-Modified" in response.headers
+    ):
+        _cache.set(
+            key,
+            {
+                "url": response.url,
+                "headers": {
+                    name: response.headers[name]
+                    for name in STORED_HEADERS
+                    if name in response.headers
+                },
+            },
+            response.content,
+        )
+    return response
+
+
+def get(
+    url: str,
+    *,
+    accept: str = DEFAULT_ACCEPT,
+    params: dict | None = None,
+    timeout: float = 30.0,
+    immutable: bool = False,
+) -> requests.Response:
+    """
+    GET a GitHub URL, revalidating a cached response (if any) with a conditional request.
+
+    Parameters
+    ------
+    url : str
+        The full URL, e.g. f"{API_URL}/repos/{owner}/{repo}"
+    accept : str, optional
+        The media type to request, e.g. "application/vnd.github.v3.diff" for the diff of a pull request
+    params : dict, optional
+        Query parameters
+    timeout : float, optional
+        Timeout in seconds, default 30
+    immutable : bool, optional
+        The resource never changes (e.g. a file at a commit SHA), so a cached response is used without revalidation
+    """
+    response, _ = _flight.do(
+        (url, accept, tuple(sorted((params or {}).items()))),
+        lambda: _get(url, accept, params, timeout, immutable),
+    )
+    return response
+
+
+def status(url: str, *, timeout: float = 30.0) -> int:
+    """
+    The HTTP status of a GitHub URL, without following redirects, downloading the body or caching.
+
+    For e.g. the logs of a workflow run, which redirect to a (large) ZIP download: a 302 means they're available.
+    """
+    with api_session.get(
+        url, headers=headers(), allow_redirects=False, stream=True, timeout=timeout
+    ) as response:
+        return response.status_code
+
+
+def graphql(query: str, variables: dict | None = None, timeout: float = 30.0) -> dict:
+    """
+    Run a GitHub GraphQL query, and return its data. Raises ValueError if the query fails.
+
+    The GraphQL API is only available to authenticated clients, so this requires a GITHUB_TOKEN.
+    """
+    if not _token():
+        raise ValueError("The GitHub GraphQL API requires a token, set GITHUB_TOKEN")
+    resp = api_session.post(
+        GRAPHQL_URL,
+        json={"query": query, "variables": variables or {}},
+        headers=headers("application/json"),
+        timeout=timeout,
+    )
+    if resp.status_code != 200:
+        raise ValueError(f"GraphQL query failed: HTTP {resp.status_code}, {resp.text}")
+    result = resp.json()
+    if result.get("errors"):
+        raise ValueError(
+            "GraphQL query failed: "
+            + "; ".join(error.get("message", "") for error in result["errors"])
+        )
+    return result["data"]
+
+
+def repo_metadata(owner: str, repo: str) -> dict:
+    """
+    The metadata of a repository (GET /repos/{owner}/{repo}), cached for REPO_METADATA_TTL seconds
+    (for the MAX_REPO_METADATA most recently used repositories)
+    """
+    key = (owner.lower(), repo.lower())
+    with _repos_lock:
+        cached = _repos.get(key)
+        if cached:
+            _repos.move_to_end(key)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+    resp = get(f"{API_URL}/repos/{owner}/{repo}")
+    if resp.status_code != 200:
+        raise ValueError(
+            f"Unable to fetch repo metadata: HTTP {resp.status_code}, {resp.text}"
+        )
+    metadata = resp.json()
+    with _repos_lock:
+        _repos[key] = (time.monotonic() + REPO_METADATA_TTL, metadata)
+        _repos.move_to_end(key)
+        while len(_repos) > MAX_REPO_METADATA:
+            _repos.popitem(last=False)
+    return metadata
+
+
+def resolve_branch(owner: str, repo: str, branch: str | None = None):
+    """
+    Resolve a branch (the default branch if None) to the commit SHA it points to.
+
+    The SHA is resolved once per conversation, so that the conversation sees a consistent snapshot of the repository,
+    and files fetched by SHA can be cached forever.
+    Returns the branch name, and the SHA (None if it can't be resolved, e.g. an unknown branch).
+    """
+    if branch is None:
+        branch = repo_metadata(owner, repo).get("default_branch", "main")
+    try:
+        conversation_id = AgentContext.current().conversation_id
+    except LookupError:
+        conversation_id = None
+    key = (conversation_id, owner.lower(), repo.lower(), branch)
+    with _refs_lock:
+        if key in _refs:
+            _refs.move_to_end(key)
+            return branch, _refs[key]
+    resp = get(
+        f"{API_URL}/repos/{owner}/{repo}/commits/{branch}",
+        accept="application/vnd.github.sha",
+    )
+    sha = resp.text.strip() if resp.status_code == 200 else None
+    if sha is not None and not re.fullmatch(r"[0-9a-f]{40}", sha):
+        sha = None
+    # Only remember definite answers: a failure for another reason (e.g. 5xx, rate limiting) may be transient
+    if conversation_id is not None and (
+        sha is not None or resp.status_code in (404, 422)
+    ):
+        with _refs_lock:
+            _refs[key] = sha
+            while len(_refs) > MAX_RESOLVED_REFS:
+                _refs.popitem(last=False)
+    return branch, sha
@@ -0,0 +1,283 @@
+"""
+Local mirror of GitHub repository snapshots, so that exploring a repository doesn't cost a request per file and folder.
+
+The tarball of a commit is downloaded once, and unpacked into a content-addressed store on disk: each file is
+stored once under the SHA-256 of its content (so files that are the same across commits are shared), and each
+snapshot has a manifest that maps the paths to their content. The store is bounded to MAX_BYTES, by evicting
+the least recently used snapshots.
+"""
+
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterator
+
+from generative_ai_toolkit.context import AgentContext
+
+from tools import github_client
+from tools.disk_cache import CACHE_DIR
+from tools.http_client import api_session
+from tools.singleflight import SingleFlight
+
+SNAPSHOT_DIR = CACHE_DIR / "github-snapshots"
+
+MAX_BYTES = int(os.environ.get("RESEARCH_AGENT_GITHUB_SNAPSHOT_MAX_BYTES", 2 * 1024**3))
+
+# Max size of a (gzipped) tarball to download
+MAX_DOWNLOAD_BYTES = int(
+    os.environ.get("RESEARCH_AGENT_GITHUB_SNAPSHOT_MAX_DOWNLOAD_BYTES", 256 * 1024**2)
+)
+
+# Max nr of manifests that are kept in memory
+MAX_LOADED_SNAPSHOTS = 16
+
+_loaded: OrderedDict[tuple[str, str, str], "Snapshot"] = OrderedDict()
+_loaded_lock = threading.Lock()
+_flight = SingleFlight()
+_store_lock = threading.Lock()
+_active_downloads = 0
+
+
+class Snapshot:
+    """
+    The files of a repository at one commit, read from the local store
+    """
+
+    def __init__(self, owner: str, repo: str, sha: str, files: dict[str, list]):
+        self.owner = owner
+        self.repo = repo
+        self.sha = sha
+        self.files = files  # path -> [content hash, size]
+
+    def read(self, path: str) -> bytes | None:
+        """
+        The content of the file at path, or None if there's no such file
+        """
+        entry = self.files.get(path.strip("/"))
+        if entry is None:
+            return None
+        return _object_path(entry[0]).read_bytes()
+
+    def list_folder(self, folder_path: str = "") -> list[dict] | None:
+        """
+        The files and folders directly inside a folder, or None if there's no such folder
+        """
+        prefix = folder_path.strip("/") + "/" if folder_path.strip("/") else ""
+        entries: dict[str, dict] = {}
+        for path, (_, size) in self.files.items():
+            if not path.startswith(prefix):
+                continue
+            name, _, rest = path[len(prefix) :].partition("/")
+            if rest:
+                entries.setdefault(
+                    name, {"name": name, "path": prefix + name, "type": "dir"}
+                )
+            else:
+                entries[name] = {
+                    "name": name,
+                    "path": path,
+                    "type": "file",
+                    "size": size,
+                }
+        if not entries and prefix:
+            return None
+        return sorted(entries.values(), key=lambda entry: entry["name"])
+
+
+def _object_path(content_hash: str):
+    return SNAPSHOT_DIR / "objects" / content_hash[:2] / content_hash
+
+
+def _manifest_path(owner: str, repo: str, sha: str):
+    name = hashlib.sha256(f"{owner}/{repo}@{sha}".lower().encode()).hexdigest()
+    return SNAPSHOT_DIR / "manifests" / f"{name}.json"
+
+
+class _ChunkReader:
+    """
+    File-like reader over the chunks of a streamed download, that stops at max_bytes
+    """
+
+    def __init__(self, chunks: Iterator[bytes], max_bytes: int):
+        self._chunks = chunks
+        self._buffer = b""
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def read(self, n: int = -1):
+        while n < 0 or len(self._buffer) < n:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise ValueError(
+                    f"Repository tarball exceeds {self.max_bytes} bytes, too large for a snapshot"
+                )
+            self._buffer += chunk
+        n = len(self._buffer) if n < 0 else n
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+
+def _write_object(content: bytes):
+    content_hash = hashlib.sha256(content).hexdigest()
+    path = _object_path(content_hash)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+    return content_hash
+
+
+def _download(owner: str, repo: str, sha: str):
+    global _active_downloads
+    with _store_lock:
+        _active_downloads += 1
+    try:
+        files = _unpack(owner, repo, sha)
+    finally:
+        with _store_lock:
+            _active_downloads -= 1
+    _evict()
+    return files
+
+
+def _unpack(owner: str, repo: str, sha: str):
+    try:
+        stop_event = AgentContext.current().stop_event
+    except LookupError:
+        stop_event = None
+    resp = api_session.get(
+        f"{github_client.API_URL}/repos/{owner}/{repo}/tarball/{sha}",
+        headers=github_client.headers(),
+        stream=True,
+        timeout=60,
+    )
+    with resp:
+        if resp.status_code != 200:
+            raise ValueError(
+                f"Unable to download snapshot of {owner}/{repo}@{sha}: HTTP {resp.status_code}, {resp.text}"
+            )
+
+        def chunks():
+            for chunk in resp.iter_content(64 * 1024):
+                if stop_event and stop_event.is_set():
+                    raise RuntimeError("Aborted due to stop event")
+                yield chunk
+
+        files = {}
+        total_size = 0
+        reader = _ChunkReader(chunks(), MAX_DOWNLOAD_BYTES)
+        with tarfile.open(fileobj=reader, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                # Paths in the tarball are prefixed with a folder named {owner}-{repo}-{short sha}
+                _, _, path = member.name.partition("/")
+                total_size += member.size
+                if total_size > MAX_BYTES:
+                    raise ValueError(
+                        f"Repository {owner}/{repo} exceeds {MAX_BYTES} bytes, too large for a snapshot"
+                    )
+                content = tar.extractfile(member).read()
+                files[path] = [_write_object(content), member.size]
+
+    manifest_path = _manifest_path(owner, repo, sha)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=manifest_path.parent, delete=False) as f:
+        json.dump({"repo": f"{owner}/{repo}", "sha": sha, "files": files}, f)
+    os.replace(f.name, manifest_path)
+    return files
+
+
+def _evict():
+    """
+    Delete the least recently used snapshots until the store fits in MAX_BYTES,
+    and the stored files that are no longer part of any snapshot
+    """
+    with _store_lock:
+        manifest_paths = sorted(
+            (SNAPSHOT_DIR / "manifests").glob("*.json"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        kept: set[str] = set()
+        size = 0
+        for i, manifest_path in enumerate(manifest_paths):
+            try:
+                files = json.loads(manifest_path.read_text())["files"]
+            except (OSError, ValueError):
+                manifest_path.unlink(missing_ok=True)
+                continue
+            new = {content_hash: size for content_hash, size in files.values()}
+            new_size = sum(
+                object_size
+                for content_hash, object_size in new.items()
+                if content_hash not in kept
+            )
+            if i > 0 and size + new_size > MAX_BYTES:
+                manifest_path.unlink(missing_ok=True)
+                continue
+            kept.update(new)
+            size += new_size
+        if _active_downloads:
+            return  # The files of those aren't in a manifest yet, leave them until the next eviction
+        for object_path in (SNAPSHOT_DIR / "objects").glob("*/*"):
+            if object_path.name not in kept:
+                object_path.unlink(missing_ok=True)
+
+
+def _load(owner: str, repo: str, sha: str):
+    manifest_path = _manifest_path(owner, repo, sha)
+    try:
+        files = json.loads(manifest_path.read_text())["files"]
+    except (OSError, ValueError):
+        return None
+    if any(
+        not _object_path(content_hash).exists() for content_hash, _ in files.values()
+    ):
+        return None  # Partially evicted
+    os.utime(manifest_path)  # Mark as recently used
+    return files
+
+
+def get(owner: str, repo: str, sha: str) -> Snapshot:
+    """
+    The snapshot of a repository at a commit SHA, downloaded into the local store if it's not there yet
+    """
+    key = (owner.lower(), repo.lower(), sha)
+    with _loaded_lock:
+        snapshot = _loaded.get(key)
+        if snapshot is not None:
+            _loaded.move_to_end(key)
+    try:
+        if snapshot is not None:
+            os.utime(_manifest_path(owner, repo, sha))  # Mark as recently used
+    except FileNotFoundError:
+        snapshot = None  # Evicted in the meantime
+    if snapshot is not None:
+        status = "hit"
+    else:
+        files = _load(owner, repo, sha)
+        status = "disk"
+        if files is None:
+            files, shared = _flight.do(key, lambda: _download(owner, repo, sha))
+            status = "coalesced" if shared else "miss"
+        snapshot = Snapshot(owner, repo, sha, files)
+        with _loaded_lock:
+            _loaded[key] = snapshot
+            while len(_loaded) > MAX_LOADED_SNAPSHOTS:
+                _loaded.popitem(last=False)
+    try:
+        AgentContext.current().tracer.current_trace.add_attribute(
+            "ai.tool.github_snapshot", status
+        )
+    except LookupError:
+        pass
+    return snapshot
@@ -0,0 +1,411 @@
+"""
+Single-pass HTML to markdown conversion.
+
+The HTML is parsed once, as a stream of start/end/data events, and markdown is emitted while walking it.
+Script and style elements (and other non-content elements) are skipped as they are encountered,
+so there's no need for a separate cleaning pass. Uses lxml's (C based) parser when available,
+and falls back to Python's built-in html.parser otherwise.
+"""
+
+import html.parser
+import re
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "title", "head"}
+VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "param",
+    "source",
+    "track",
+    "wbr",
+}
+BLOCK_TAGS = {
+    "address",
+    "article",
+    "aside",
+    "dd",
+    "details",
+    "dialog",
+    "div",
+    "dl",
+    "dt",
+    "fieldset",
+    "figcaption",
+    "figure",
+    "footer",
+    "form",
+    "header",
+    "main",
+    "nav",
+    "p",
+    "section",
+    "summary",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+NON_PHRASING_TAGS = {"blockquote", "hr", "ol", "pre", "table", "ul"}
+INLINE_WRAPPERS = {"strong": "**", "b": "**", "em": "*", "i": "*", "code": "`"}
+
+
+class MarkdownEmitter:
+    """
+    Parser target that turns start/end/data events into markdown.
+
+    Conforms to the lxml parser target interface (start, end, data, close).
+    """
+
+    def __init__(self):
+        self.parts: list[str] = []
+        self.heading_anchors: list[list[str]] = []
+        self._pending_anchors: list[str] = []
+        self._heading_start: int | None = None
+        self._stack: list[str] = []
+        self._skip_depth = 0
+        self._pre_depth = 0
+        self._blockquote_depth = 0
+        self._lists: list[list] = []  # [list tag, item counter]
+        self._list_marker: str | None = None
+        self._pending_newlines = 0
+        self._pending_quote = 0
+        self._at_line_start = True
+        self._inline: list[tuple[str, int, str | None]] = (
+            []
+        )  # (tag, index in parts, href)
+        self._tables: list[dict] = []
+        self._fence_index: int | None = None
+
+    # Output helpers
+
+    def _block(self, newlines: int = 2):
+        if self.parts:
+            if self._lists and newlines > 1:
+                newlines = 1
+            if self._pending_newlines:
+                self._pending_quote = min(self._pending_quote, self._blockquote_depth)
+            else:
+                self._pending_quote = self._blockquote_depth
+            self._pending_newlines = max(self._pending_newlines, newlines)
+
+    def _flush(self):
+        if self._pending_newlines and self.parts:
+            # Blank lines inside a blockquote must be quoted too, to not end the blockquote
+            quote = ">" * self._pending_quote
+            self.parts.append(("\n" + quote) * (self._pending_newlines - 1) + "\n")
+            self._at_line_start = True
+        self._pending_newlines = 0
+        if self._at_line_start:
+            prefix = "> " * self._blockquote_depth
+            if self._list_marker is not None:
+                prefix += "  " * max(0, len(self._lists) - 1) + self._list_marker
+                self._list_marker = None
+            elif self._lists:
+                prefix += "  " * len(self._lists)
+            if prefix:
+                self.parts.append(prefix)
+                self._at_line_start = False
+
+    def _write(self, text: str):
+        self._flush()
+        self.parts.append(text)
+        self._at_line_start = text.endswith("\n")
+
+    def _ends_with_space(self):
+        return not self.parts or self.parts[-1][-1:] in (" ", "\n")
+
+    # Parser target interface
+
+    def start(self, tag: str, attrib):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag == "body":
+            self._skip_depth = 0  # In case <head> was never closed
+        if self._skip_depth or tag in SKIP_TAGS:
+            if tag not in VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if tag not in VOID_TAGS:
+            self._close_implicitly(tag)
+            self._stack.append(tag)
+
+        # Element ids are linked to the heading that follows them (if no text comes in between),
+        # or otherwise to the heading of the section they are in
+        anchor = attrib.get("id") or (attrib.get("name") if tag == "a" else None)
+        if anchor:
+            self._pending_anchors.append(anchor)
+
+        if tag in HEADING_TAGS:
+            self._block()
+            self._heading_start = len(self.parts)
+            self._write("#" * int(tag[1]) + " ")
+            self.heading_anchors.append(self._pending_anchors)
+            self._pending_anchors = []
+        elif tag in BLOCK_TAGS:
+            self._block()
+        elif tag == "br":
+            if self._pre_depth:
+                self.parts.append("\n")
+            else:
+                self._block(1)
+        elif tag == "hr":
+            self._block()
+            self._write("---")
+            self._block()
+        elif tag == "blockquote":
+            self._block()
+            self._blockquote_depth += 1
+        elif tag in ("ul", "ol"):
+            self._block(1 if self._lists else 2)
+            start = attrib.get("start", "1")
+            self._lists.append([tag, int(start) - 1 if start.isdigit() else 0])
+        elif tag == "li":
+            self._block(1)
+            self._list_marker = "- "
+            if self._lists:
+                self._lists[-1][1] += 1
+                list_tag, counter = self._lists[-1]
+                if list_tag == "ol":
+                    self._list_marker = f"{counter}. "
+        elif tag == "pre":
+            self._block()
+            self._write("```\n")
+            self._fence_index = len(self.parts) - 1
+            self._pre_depth += 1
+            self._set_fence_language(attrib)
+        elif tag == "code" and self._pre_depth:
+            self._set_fence_language(attrib)
+        elif tag in INLINE_WRAPPERS or tag == "a":
+            if not self._pre_depth:
+                self._flush()  # So that list markers etc. end up outside of the wrapped text
+            self._inline.append((tag, len(self.parts), attrib.get("href")))
+        elif tag == "img":
+            src = attrib.get("src", "")
+            alt = " ".join(attrib.get("alt", "").split())
+            if src and not src.startswith("data:"):
+                if not self._ends_with_space() and not self._at_line_start:
+                    self._write(" ")
+                self._write(f"![{alt}]({src})")
+            elif alt:
+                self.data(alt)
+        elif tag == "table":
+            self._block()
+            self._tables.append({"rows": [], "cell_start": None})
+        elif tag == "tr" and self._tables:
+            self._tables[-1]["rows"].append([])
+        elif tag in ("td", "th") and self._tables:
+            self._tables[-1]["cell_start"] = len(self.parts)
+
+    def end(self, tag: str):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if self._skip_depth:
+            if tag not in VOID_TAGS:
+                self._skip_depth -= 1
+            return
+        if tag in VOID_TAGS:
+            return
+        self._close(tag)
+
+    def _close_implicitly(self, tag: str):
+        """
+        Close elements whose end tag may be omitted, e.g. <li>a<li>b (lxml already does this for us)
+        """
+        if tag == "li":
+            for open_tag in reversed(self._stack):
+                if open_tag in ("li", "ul", "ol"):
+                    if open_tag == "li":
+                        self._close("li")
+                    break
+        elif self._stack and self._stack[-1] == "p":
+            if tag in BLOCK_TAGS or tag in HEADING_TAGS or tag in NON_PHRASING_TAGS:
+                self._close("p")
+
+    def _close(self, tag: str):
+        if tag not in self._stack:
+            return  # Stray end tag
+        while self._stack:
+            open_tag = self._stack.pop()
+            self._end(open_tag)
+            if open_tag == tag:
+                break
+
+    def _end(self, tag: str):
+        if tag in HEADING_TAGS:
+            if self._heading_start is not None:
+                if not "".join(self.parts[self._heading_start :]).strip("# "):
+                    # Drop empty headings
+                    del self.parts[self._heading_start :]
+                    self._pending_anchors[:0] = self.heading_anchors.pop()
+                self._heading_start = None
+            self._block()
+        elif tag in BLOCK_TAGS:
+            self._block()
+        elif tag == "blockquote":
+            self._blockquote_depth = max(0, self._blockquote_depth - 1)
+            self._block()
+        elif tag in ("ul", "ol"):
+            if self._lists:
+                self._lists.pop()
+            self._block(1 if self._lists else 2)
+        elif tag == "li":
+            self._list_marker = None
+            self._block(1)
+        elif tag == "pre":
+            self._pre_depth = max(0, self._pre_depth - 1)
+            if not self.parts[-1].endswith("\n"):
+                self.parts.append("\n")
+            self.parts.append("```")
+            self._at_line_start = False
+            self._fence_index = None
+            self._block()
+        elif tag in INLINE_WRAPPERS or tag == "a":
+            self._end_inline(tag)
+        elif tag in ("td", "th") and self._tables:
+            table = self._tables[-1]
+            if table["cell_start"] is None:
+                return
+            cell = "".join(self.parts[table["cell_start"] :])
+            del self.parts[table["cell_start"] :]
+            table["cell_start"] = None
+            cell = " ".join(cell.split()).replace("|", "\\|")
+            if not table["rows"]:
+                table["rows"].append([])
+            table["rows"][-1].append(cell)
+            self._pending_newlines = 0
+            self._at_line_start = not self.parts or self.parts[-1].endswith("\n")
+        elif tag == "table" and self._tables:
+            self._emit_table(self._tables.pop())
+
+    def _end_inline(self, tag: str):
+        for i in range(len(self._inline) - 1, -1, -1):
+            if self._inline[i][0] == tag:
+                break
+        else:
+            return
+        _, start, href = self._inline.pop(i)
+        if self._pre_depth:
+            return
+        inner = "".join(self.parts[start:])
+        text = inner.strip()
+        if not text:
+            return
+        leading = inner[: len(inner) - len(inner.lstrip())]
+        trailing = inner[len(inner.rstrip()) :]
+        if tag == "a":
+            if not href or href.startswith("javascript:"):
+                return
+            wrapped = f"[{text}]({href})"
+        else:
+            marker = INLINE_WRAPPERS[tag]
+            wrapped = f"{marker}{text}{marker}"
+        del self.parts[start:]
+        self.parts.append(leading + wrapped + trailing)
+
+    def _emit_table(self, table: dict):
+        rows = [row for row in table["rows"] if any(row)]
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        rows = [row + [""] * (width - len(row)) for row in rows]
+        lines = [
+            "| " + " | ".join(rows[0]) + " |",
+            "|" + " --- |" * width,
+            *("| " + " | ".join(row) + " |" for row in rows[1:]),
+        ]
+        self._block()
+        self._write("\n".join(lines))
+        self._block()
+
+    def _set_fence_language(self, attrib):
+        if self._fence_index is None or self._fence_index != len(self.parts) - 1:
+            return
+        match = re.search(r"(?:lang|language)-([\w+#.-]+)", attrib.get("class", ""))
+        if match:
+            self.parts[self._fence_index] = f"```{match.group(1)}\n"
+
+    def data(self, data: str):
+        if self._skip_depth or not data:
+            return
+        if self._pre_depth:
+            self._flush()
+            self.parts.append(data)
+            self._at_line_start = data.endswith("\n")
+            return
+        text = re.sub(r"\s+", " ", data)
+        if text == " ":
+            if not self._at_line_start and not self._ends_with_space():
+                self.parts.append(" ")
+            return
+        if self._at_line_start or self._pending_newlines or self._ends_with_space():
+            text = text.lstrip()
+        if self._pending_anchors:
+            if self.heading_anchors:
+                self.heading_anchors[-1].extend(self._pending_anchors)
+            self._pending_anchors = []
+        self._write(text)
+
+    def comment(self, text: str):
+        pass
+
+    def close(self):
+        while self._stack:
+            self._end(self._stack.pop())
+        markdown = "".join(self.parts)
+        markdown = re.sub(r"[ \t]+\n", "\n", markdown)
+        markdown = re.sub(r"\n{3,}", "\n\n", markdown)
+        return markdown.strip()
+
+
+class _StdlibParser(html.parser.HTMLParser):
+    """
+    Adapter that feeds html.parser events into a MarkdownEmitter
+    """
+
+    def __init__(self, target: MarkdownEmitter):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, {name: value or "" for name, value in attrs})
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+
+def html_to_markdown(html: str, heading_anchors: list[list[str]] | None = None) -> str:
+    """
+    Convert HTML to markdown in a single pass.
+
+    Parameters
+    -----
+    html : str
+        The HTML to convert
+    heading_anchors : list, optional
+        If provided, is filled with a list of element ids per heading in the markdown (in order),
+        i.e. the ids of the heading itself and of the elements that belong to its section
+    """
+    emitter = MarkdownEmitter()
+    if etree is not None:
+        parser = etree.HTMLParser(target=emitter, remove_comments=True)
+        parser.feed(html)
+        markdown = parser.close()
+    else:
+        parser = _StdlibParser(emitter)
+        parser.feed(html)
+        parser.close()
+        markdown = emitter.close()
+    if heading_anchors is not None:
+        heading_anchors.extend(emitter.heading_anchors)
+    return markdown
@@ -0,0 +1,240 @@
+import email.utils
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Literal
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from tools.disk_cache import DiskCache
+
+# Freshness lifetime for responses that don't specify one themselves (Cache-Control / Expires)
+DEFAULT_TTL = float(os.environ.get("RESEARCH_AGENT_HTTP_CACHE_TTL", 3600))
+MAX_BYTES = int(os.environ.get("RESEARCH_AGENT_HTTP_CACHE_MAX_BYTES", 512 * 1024**2))
+CHUNK_SIZE = 64 * 1024
+
+# Response headers that are kept in the cache, and refreshed upon revalidation
+STORED_HEADERS = [
+    "Content-Type",
+    "ETag",
+    "Last-Modified",
+    "Cache-Control",
+    "Expires",
+    "Date",
+]
+
+_cache = DiskCache("http", max_bytes=MAX_BYTES)
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status_code: int
+    headers: CaseInsensitiveDict = field(default_factory=CaseInsensitiveDict)
+    content: bytes = b""
+    cache_status: Literal["hit", "revalidated", "miss"] = "miss"
+    truncated: bool = False
+    personalized: bool = False
+
+    @property
+    def encoding(self):
+        return get_encoding_from_headers(self.headers)
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+def canonical_url(url: str):
+    """
+    The URL without fragment, and with lowercase scheme and host, and without default port
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        netloc += f":{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def _cache_control(headers: CaseInsensitiveDict) -> dict[str, str | None]:
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+def _expires_at(headers: CaseInsensitiveDict) -> float | None:
+    """
+    Determine until when a response is fresh, or None if it should not be stored at all
+    """
+    now = time.time()
+    cache_control = _cache_control(headers)
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return now
+    max_age = cache_control.get("max-age")
+    if max_age is not None and re.fullmatch(r"\d+", max_age):
+        age = headers.get("Age", "0")
+        return now + int(max_age) - (int(age) if age.isdigit() else 0)
+    if "Expires" in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["Expires"])
+            return expires.timestamp()
+        except (TypeError, ValueError):
+            return now  # Invalid Expires header means: already expired
+    return now + DEFAULT_TTL
+
+
+def _personalized(response: requests.Response):
+    """
+    Whether the response may be specific to the cookies of the session, so that it can't be shared with other sessions
+    """
+    return any(
+        "Set-Cookie" in hop.headers or "Cookie" in hop.request.headers
+        for hop in [*response.history, response]
+    )
+
+
+def sends_cookies(session: requests.Session, url: str):
+    """
+    Whether the session has cookies for the URL, so that the response to it may be specific to the session
+    """
+    return (
+        requests.cookies.get_cookie_header(
+            session.cookies, requests.Request("GET", url).prepare()
+        )
+        is not None
+    )
+
+
+def _store(key: str, response: CachedResponse, personalized: bool = False):
+    expires_at = _expires_at(response.headers)
+    if expires_at is None or personalized:
+        _cache.delete(key)
+        return
+    meta = {
+        "url": response.url,
+        "headers": {
+            name: response.headers[name]
+            for name in STORED_HEADERS
+            if name in response.headers
+        },
+        "expires_at": expires_at,
+        "truncated": response.truncated,
+    }
+    _cache.set(key, meta, response.content)
+
+
+def _read_body(
+    response: requests.Response,
+    timeout: float,
+    max_bytes: int | None,
+    validate_sample: Callable[[CaseInsensitiveDict, bytes], None] | None,
+):
+    """
+    Read the body of a streamed response, giving validate_sample the chance to reject it
+    after the first chunk, and stopping at max_bytes
+    """
+    read_until = time.monotonic() + timeout
+    chunks: list[bytes] = []
+    size = 0
+    truncated = False
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        if not chunks and validate_sample:
+            validate_sample(response.headers, chunk)
+        if max_bytes is not None and size + len(chunk) > max_bytes:
+            chunks.append(chunk[: max_bytes - size])
+            truncated = True
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if time.monotonic() > read_until:
+            raise requests.Timeout(
+                f"Reading the response took more than {timeout} seconds"
+            )
+    return b"".join(chunks), truncated
+
+
+def get(
+    session: requests.Session,
+    url: str,
+    *,
+    headers: dict[str, str],
+    timeout: float,
+    max_bytes: int | None = None,
+    validate_headers: Callable[[CaseInsensitiveDict], None] | None = None,
+    validate_sample: Callable[[CaseInsensitiveDict, bytes], None] | None = None,
+) -> CachedResponse:
+    """
+    GET the URL through the on-disk HTTP cache.
+
+    Fresh responses are served from the cache without a request.
+    Stale responses are revalidated with a conditional request (ETag / Last-Modified),
+    so that an unchanged resource only costs a 304 round trip.
+    Only successful (200) responses are stored, keyed by canonical URL. The cache is shared by all sessions,
+    so responses that are private, set cookies, or were requested with cookies are not stored
+    (and are marked as personalized).
+
+    The response body is streamed: validate_headers is called before the body is downloaded,
+    and validate_sample with the first chunk of the body, before the rest is downloaded.
+    Both may raise to abort the download. Bodies larger than max_bytes are truncated (and marked as such).
+    """
+    key = canonical_url(url)
+    cached = _cache.get(key)
+    if cached:
+        meta, body = cached
+        cached_response = CachedResponse(
+            url=meta["url"],
+            status_code=200,
+            headers=CaseInsensitiveDict(meta["headers"]),
+            content=body,
+            cache_status="hit",
+            truncated=meta.get("truncated", False),
+        )
+        if validate_headers:
+            validate_headers(cached_response.headers)
+        if validate_sample:
+            validate_sample(cached_response.headers, body[:CHUNK_SIZE])
+        if time.time() < meta["expires_at"]:
+            return cached_response
+        headers = headers.copy()
+        if "ETag" in cached_response.headers:
+            headers["If-None-Match"] = cached_response.headers["ETag"]
+        if "Last-Modified" in cached_response.headers:
+            headers["If-Modified-Since"] = cached_response.headers["Last-Modified"]
+
+    with session.get(
+        url, headers=headers, allow_redirects=True, timeout=timeout, stream=True
+    ) as response:
+        if cached and response.status_code == 304:
+            for name in STORED_HEADERS:
+                if name in response.headers:
+                    cached_response.headers[name] = response.headers[name]
+            cached_response.cache_status = "revalidated"
+            cached_response.personalized = _personalized(response)
+            _store(key, cached_response, cached_response.personalized)
+            return cached_response
+
+        if validate_headers:
+            validate_headers(response.headers)
+        content, truncated = _read_body(response, timeout, max_bytes, validate_sample)
+
+    fetched = CachedResponse(
+        url=response.url,
+        status_code=response.status_code,
+        headers=response.headers,
+        content=content,
+        truncated=truncated,
+        personalized=_personalized(response),
+    )
+    if response.status_code == 200:
+        _store(key, fetched, fetched.personalized)
+    return fetched
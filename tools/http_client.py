@@ -0,0 +1,188 @@
+"""
+Central HTTP client layer of the web research tools.
+
+All HTTP traffic goes through one shared connection pool, so that keep-alive connections are reused
+across conversations. The pool is bounded: per host (configurable) and in the nr of hosts kept,
+and connections to hosts that have been idle for a while are closed.
+
+Conversations get their own session, so cookies are never shared between conversations.
+API calls (search, GitHub) use a cookieless session.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import port_by_scheme
+from urllib3.util import parse_url
+
+# Max nr of hosts that connections are kept open to, and max nr of connections kept open per host
+POOL_HOSTS = int(os.environ.get("RESEARCH_AGENT_HTTP_POOL_HOSTS", 64))
+POOL_MAXSIZE = int(os.environ.get("RESEARCH_AGENT_HTTP_POOL_MAXSIZE", 4))
+
+# Per host overrides of POOL_MAXSIZE, e.g. "api.github.com=8,api.search.brave.com=4"
+POOL_MAXSIZE_PER_HOST = {
+    host.strip().lower(): int(maxsize)
+    for host, _, maxsize in (
+        entry.partition("=")
+        for entry in os.environ.get(
+            "RESEARCH_AGENT_HTTP_POOL_MAXSIZE_PER_HOST", ""
+        ).split(",")
+        if "=" in entry
+    )
+}
+
+# Connections to hosts that haven't been used for this nr of seconds are closed
+POOL_IDLE_TIMEOUT = float(os.environ.get("RESEARCH_AGENT_HTTP_POOL_IDLE_TIMEOUT", 90))
+
+# Max nr of conversation sessions (cookie jars) kept
+MAX_SESSIONS = int(os.environ.get("RESEARCH_AGENT_HTTP_MAX_SESSIONS", 25))
+
+
+class _SharedAdapter(HTTPAdapter):
+    """
+    Transport adapter with a max pool size per host, that closes the connections to idle hosts
+    """
+
+    def __init__(self):
+        super().__init__(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE)
+        self._last_used: dict[tuple[str, str, int], float] = {}
+        self._lock = threading.Lock()
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(
+            request, verify, cert
+        )
+        pool_kwargs["maxsize"] = POOL_MAXSIZE_PER_HOST.get(
+            host_params["host"].lower(), POOL_MAXSIZE
+        )
+        return host_params, pool_kwargs
+
+    def send(self, request, *args, **kwargs):
+        self._close_idle()
+        try:
+            return super().send(request, *args, **kwargs)
+        finally:
+            url = parse_url(request.url)
+            scheme = (url.scheme or "http").lower()
+            host = (
+                scheme,
+                (url.host or "").lower(),
+                url.port or port_by_scheme[scheme],
+            )
+            with self._lock:
+                self._last_used[host] = time.monotonic()
+
+    def _close_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = {
+                host
+                for host, last_used in self._last_used.items()
+                if now - last_used > POOL_IDLE_TIMEOUT
+            }
+            for host in idle:
+                del self._last_used[host]
+        if not idle:
+            return
+        for pool_key in self.poolmanager.pools.keys():
+            if (pool_key.key_scheme, pool_key.key_host, pool_key.key_port) in idle:
+                # Removing the pool from the pool manager closes its connections
+                self.poolmanager.pools.pop(pool_key, None)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            last_used = dict(self._last_used)
+        pools = []
+        for pool_key in self.poolmanager.pools.keys():
+            pool = self.poolmanager.pools.get(pool_key)
+            if pool is None:
+                continue
+            host = (pool_key.key_scheme, pool_key.key_host, pool_key.key_port)
+            pools.append(
+                {
+                    "scheme": pool_key.key_scheme,
+                    "host": pool_key.key_host,
+                    "port": pool_key.key_port,
+                    "maxsize": pool_key.key_maxsize,
+                    # The pool queue is padded with None for connections that are yet to be opened
+                    "idle_connections": (
+                        sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                        if pool.pool
+                        else 0
+                    ),
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle_seconds": (
+                        round(now - last_used[host], 1) if host in last_used else None
+                    ),
+                }
+            )
+        return pools
+
+
+_adapter = _SharedAdapter()
+_sessions: OrderedDict[tuple[str, str], requests.Session] = OrderedDict()
+_sessions_lock = threading.Lock()
+_sessions_closed = 0
+
+
+def _new_session(cookie_policy: DefaultCookiePolicy | None = None):
+    session = requests.Session()
+    if cookie_policy is not None:
+        session.cookies.set_policy(cookie_policy)
+    session.mount("https://", _adapter)
+    session.mount("http://", _adapter)
+    return session
+
+
+def _close_session(session: requests.Session):
+    # Unmount the shared adapter first, so closing the session doesn't close the shared pool
+    session.adapters.clear()
+    session.cookies.clear()
+    session.close()
+
+
+def get_session(principal_id: str, conversation_id: str):
+    """
+    The session of a conversation: its own cookie jar, on top of the shared connection pool.
+
+    The least recently used sessions are closed once there are more than MAX_SESSIONS.
+    """
+    global _sessions_closed
+    key = (principal_id, conversation_id)
+    evicted: list[requests.Session] = []
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _new_session()
+            while len(_sessions) > MAX_SESSIONS:
+                evicted.append(_sessions.popitem(last=False)[1])
+                _sessions_closed += 1
+        else:
+            _sessions.move_to_end(key)
+    for evicted_session in evicted:
+        _close_session(evicted_session)
+    return session
+
+
+# Session for API calls: shared by all conversations, so it doesn't accept cookies
+api_session = _new_session(cookie_policy=DefaultCookiePolicy(allowed_domains=[]))
+
+
+def pool_stats():
+    """
+    Statistics of the shared connection pool and the conversation sessions
+    """
+    with _sessions_lock:
+        sessions = len(_sessions)
+    return {
+        "sessions": sessions,
+        "sessions_closed": _sessions_closed,
+        "pools": _adapter.stats(),
+    }
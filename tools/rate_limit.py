@@ -0,0 +1,97 @@
+"""
+Process-wide rate limiting of API calls, so that concurrent tool calls space their requests in advance,
+instead of each of them running into (and retrying after) HTTP 429 responses.
+"""
+
+import re
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out tokens in order of request (first come, first served).
+
+    Implemented as a schedule (GCRA): each caller reserves the next free slot up front, and waits until it's due.
+    Slots are 1 / rate apart, and up to capacity slots can be used at once (bursts).
+    The bucket is kept in line with the rate limit the API reports in its X-RateLimit-* headers.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, max_wait: float = 60.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self._next_slot_at = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event: threading.Event | None = None):
+        """
+        Wait for a token, and return the nr of seconds waited.
+
+        Raises RuntimeError if the stop event is set while waiting, or if the wait would exceed max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            interval = 1 / self.rate
+            next_slot_at = max(self._next_slot_at, now, self._blocked_until)
+            slot_at = max(
+                now, self._blocked_until, next_slot_at - (self.capacity - 1) * interval
+            )
+            if slot_at - now > self.max_wait:
+                raise RuntimeError(
+                    f"Rate limit exceeded, next request possible in {slot_at - now:.0f} seconds"
+                )
+            self._next_slot_at = next_slot_at + interval
+        while True:
+            with self._lock:
+                # The API may have told us to hold off in the meantime
+                wait_until = max(slot_at, self._blocked_until)
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                return wait_until - now
+            if remaining > self.max_wait:
+                raise RuntimeError(
+                    f"Rate limit exceeded, next request possible in {remaining:.0f} seconds"
+                )
+            if stop_event and stop_event.is_set():
+                raise RuntimeError("Aborted due to stop event")
+            time.sleep(min(remaining, 0.1))
+
+    def update(self, headers: CaseInsensitiveDict):
+        """
+        Align the bucket with the X-RateLimit-* headers of a response.
+
+        The headers hold comma separated values, one per rate limit window, e.g. "1, 15000"
+        for a per second and a per month limit (the window sizes are given in X-RateLimit-Policy).
+        """
+        limits = _parse_values(headers.get("X-RateLimit-Limit"))
+        remaining = _parse_values(headers.get("X-RateLimit-Remaining"))
+        resets = _parse_values(headers.get("X-RateLimit-Reset"))
+        windows = [
+            float(window)
+            for window in re.findall(r"w=(\d+)", headers.get("X-RateLimit-Policy", ""))
+        ]
+        if not limits or len(remaining) != len(limits) or len(resets) != len(limits):
+            return
+        with self._lock:
+            now = time.monotonic()
+            # The shortest window determines the pace
+            window = windows[0] if len(windows) == len(limits) else 1.0
+            self.rate = limits[0] / window
+            self.capacity = max(1.0, limits[0])
+            for window_remaining, window_reset in zip(remaining, resets):
+                if window_remaining < 1:
+                    # Nothing left in this window: no requests until it resets
+                    self._blocked_until = max(self._blocked_until, now + window_reset)
+
+
+def _parse_values(header: str | None):
+    if not header:
+        return []
+    try:
+        return [float(value) for value in header.split(",")]
+    except ValueError:
+        return []
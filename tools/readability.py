@@ -0,0 +1,225 @@
+"""
+Readability-style extraction of the main content of a web page.
+
+Blocks of text are scored by their length and nr of commas, and the score is propagated to their ancestors.
+The ancestor with the highest score, discounted by its link density, is taken as the main content,
+together with those of its siblings that look like they belong to it.
+Navigation, cookie banners, footers, sidebars etc. are removed up front.
+"""
+
+import re
+
+from bs4 import BeautifulSoup, Tag
+
+try:
+    import lxml  # noqa: F401
+
+    PARSER = "lxml"
+except ImportError:  # pragma: no cover
+    PARSER = "html.parser"
+
+REMOVE_TAGS = [
+    "aside",
+    "button",
+    "dialog",
+    "iframe",
+    "input",
+    "nav",
+    "noscript",
+    "script",
+    "select",
+    "style",
+    "svg",
+    "template",
+]
+REMOVE_ROLES = {
+    "alert",
+    "alertdialog",
+    "banner",
+    "complementary",
+    "contentinfo",
+    "dialog",
+    "menu",
+    "menubar",
+    "navigation",
+    "search",
+}
+UNLIKELY = re.compile(
+    r"ad-break|advert|agegate|banner|breadcrumb|combx|comment|consent|cookie|disqus|footer|gdpr|"
+    r"header|menu|modal|nav|newsletter|pager|pagination|popup|promo|rail|related|remark|replies|"
+    r"share|shoutbox|sidebar|skyscraper|social|sponsor|subscribe|topbar",
+    re.I,
+)
+MAYBE = re.compile(r"article|body|column|content|document|entry|main|post|story", re.I)
+POSITIVE = re.compile(
+    r"article|blog|body|content|document|entry|main|page|post|story|text", re.I
+)
+NEGATIVE = re.compile(
+    r"com-|comment|contact|foot|footnote|hidden|masthead|media|meta|outbrain|promo|related|"
+    r"scroll|shopping|shoutbox|sidebar|sponsor|tags|tool|widget",
+    re.I,
+)
+SCORED_TAGS = ["p", "pre", "td", "dd", "blockquote", "li"]
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+def _text_length(tag: Tag):
+    return len(" ".join(tag.get_text(" ").split()))
+
+
+def _link_density(tag: Tag):
+    text_length = _text_length(tag)
+    if not text_length:
+        return 0.0
+    link_length = sum(_text_length(a) for a in tag.find_all("a"))
+    return min(1.0, link_length / text_length)
+
+
+def _class_weight(tag: Tag):
+    weight = 0
+    for value in (" ".join(tag.get("class") or []), tag.get("id") or ""):
+        if not value:
+            continue
+        if NEGATIVE.search(value):
+            weight -= 25
+        if POSITIVE.search(value):
+            weight += 25
+    return weight
+
+
+def _initial_score(tag: Tag):
+    score = _class_weight(tag)
+    if tag.name in ("article", "main"):
+        score += 10
+    elif tag.name == "div":
+        score += 5
+    elif tag.name in ("pre", "td", "blockquote"):
+        score += 3
+    elif tag.name in ("ol", "ul", "dl", "dd", "dt", "li", "form"):
+        score -= 3
+    elif tag.name in HEADING_TAGS or tag.name == "th":
+        score -= 5
+    return score
+
+
+def _remove_clutter(body: Tag):
+    for tag in body.find_all(REMOVE_TAGS):
+        tag.decompose()
+    for tag in body.find_all(True):
+        if tag.decomposed or tag.name in ("article", "main"):
+            continue
+        # The header and footer of the page are clutter, but those of the article itself hold e.g. its title
+        if tag.name in ("header", "footer") and not tag.find_parent(
+            ["article", "main"]
+        ):
+            tag.decompose()
+            continue
+        if (tag.get("role") or "").lower() in REMOVE_ROLES:
+            tag.decompose()
+            continue
+        match_string = " ".join(tag.get("class") or []) + " " + (tag.get("id") or "")
+        if UNLIKELY.search(match_string) and not MAYBE.search(match_string):
+            tag.decompose()
+    # Forms are clutter when they're small or mostly links (search boxes, newsletter sign-ups, etc.),
+    # but some sites (e.g. ASP.NET WebForms) wrap the whole page in one form
+    for form in body.find_all("form"):
+        if form.decomposed:
+            continue
+        if _text_length(form) < 200 or _link_density(form) > 0.5:
+            form.decompose()
+
+
+def _score_candidates(body: Tag):
+    scores: dict[int, float] = {}
+    tags: dict[int, Tag] = {}
+    for block in body.find_all(SCORED_TAGS):
+        text_length = _text_length(block)
+        if text_length < 25:
+            continue
+        content_score = 1 + block.get_text().count(",") + min(text_length / 100, 3)
+        for level, ancestor in enumerate(block.parents):
+            if level >= 3 or ancestor.name in ("body", "html", "[document]"):
+                break
+            if id(ancestor) not in scores:
+                scores[id(ancestor)] = _initial_score(ancestor)
+                tags[id(ancestor)] = ancestor
+            scores[id(ancestor)] += content_score / (1 if level == 0 else level * 2)
+    return {
+        key: (tags[key], score * (1 - _link_density(tags[key])))
+        for key, score in scores.items()
+    }
+
+
+def _top_candidate(candidates: dict[int, tuple[Tag, float]]):
+    ranked = sorted(candidates.values(), key=lambda candidate: -candidate[1])
+    top, top_score = ranked[0]
+
+    # If several of the best candidates share an ancestor, e.g. sections of one article, take that ancestor
+    for ancestor in top.parents:
+        if ancestor.name in ("body", "html", "[document]"):
+            break
+        shared = sum(
+            1
+            for candidate, score in ranked[1:5]
+            if score >= top_score * 0.75 and ancestor in candidate.parents
+        )
+        if shared >= 2:
+            top = ancestor
+            top_score = candidates.get(id(ancestor), (ancestor, top_score))[1]
+            break
+    return top, top_score
+
+
+def _belongs_to_article(
+    sibling: Tag, candidates: dict[int, tuple[Tag, float]], threshold: float
+):
+    if sibling.name in HEADING_TAGS:
+        return True
+    if id(sibling) in candidates and candidates[id(sibling)][1] >= threshold:
+        return True
+    if sibling.name == "p":
+        text_length = _text_length(sibling)
+        link_density = _link_density(sibling)
+        if text_length > 80 and link_density < 0.25:
+            return True
+        if link_density == 0 and re.search(r"\.( |$)", sibling.get_text()):
+            return True
+    return False
+
+
+def extract_article(html: str) -> tuple[str, float]:
+    """
+    Extract the main content from an HTML page.
+
+    Returns the HTML of the main content, and the ratio of its text length to that of the full page.
+
+    Parameters
+    -----
+    html : str
+        The HTML of the full page
+    """
+    soup = BeautifulSoup(html, PARSER)
+    body = soup.body or soup
+    for tag in body.find_all(["script", "style", "noscript", "template"]):
+        tag.decompose()
+    page_text_length = _text_length(body)
+
+    _remove_clutter(body)
+    candidates = _score_candidates(body)
+    if not candidates:
+        article, article_text_length = str(body), _text_length(body)
+    else:
+        top, top_score = _top_candidate(candidates)
+        threshold = max(10.0, top_score * 0.2)
+        parts = []
+        article_text_length = 0
+        siblings = top.parent.find_all(True, recursive=False) if top.parent else [top]
+        for sibling in siblings:
+            if sibling is top or _belongs_to_article(sibling, candidates, threshold):
+                parts.append(str(sibling))
+                article_text_length += _text_length(sibling)
+        article = "<div>" + "".join(parts) + "</div>"
+
+    return article, (
+        article_text_length / page_text_length if page_text_length else 1.0
+    )
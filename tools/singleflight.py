@@ -0,0 +1,47 @@
+"""
+In-flight request coalescing: concurrent identical requests (e.g. from different conversations)
+are performed once, and all callers get the result of that one request.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time: callers that ask for a key that is already in flight,
+    wait for that call and share its result (or exception) instead of making the call themselves
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> tuple[T, bool]:
+        """
+        Call fn, unless a call for the same key is in flight already, then wait for that one.
+
+        Returns the result, and whether it was shared with (i.e. came from) another caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
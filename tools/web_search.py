@@ -1,75 +1,116 @@
+import functools
+import html
+import json
 import os
+import re
 import time
+import unicodedata
 
-import requests
 from generative_ai_toolkit.agent import registry
 from generative_ai_toolkit.context import AgentContext
 
+from tools import engine
+from tools.disk_cache import DiskCache
+from tools.fetch_html import PREFETCH_TOP_K, canonical_url, prefetch
+from tools.http_client import api_session
+from tools.rate_limit import TokenBucket
 from tools.registries import web_research
+from tools.singleflight import SingleFlight
 
+# How long search results are reused, and the max total size of the search result cache
+CACHE_TTL = float(os.environ.get("RESEARCH_AGENT_SEARCH_CACHE_TTL", 6 * 3600))
+CACHE_MAX_BYTES = int(
+    os.environ.get("RESEARCH_AGENT_SEARCH_CACHE_MAX_BYTES", 64 * 1024**2)
+)
 
-@registry.tool(tool_registry=web_research)
-def web_search(query: str, max_results: int = 3, max_retries: int = 10) -> list:
-    """
-    Perform a web search using Brave Search for AI API.
+# Max nr of requests per second to the Brave Search API; the X-RateLimit-* response headers take precedence
+RATE_LIMIT = float(os.environ.get("RESEARCH_AGENT_SEARCH_RATE_LIMIT", 1))
 
-    Parameters
-    -----
-    query : str
-        The query to web search
-    max_results : int
-        Number of results to retrieve (by default: 3, max: 20)
-    max_retries : int
-        Number of times to retry, in case of rate limit errors (by default: 10)
+API_URL = "https://api.search.brave.com/res/v1/web/search"
+
+# Max nr of extra snippets per result, and max length of each snippet, when snippets are included
+MAX_SNIPPETS = 3
+SNIPPET_MAX_CHARS = 300
+
+# Max nr of searches of one web_search_many call that are in flight at the same time
+MAX_PARALLEL_SEARCHES = 4
+
+ABORTED = "Aborted due to stop event"
+
+_cache = DiskCache("search", max_bytes=CACHE_MAX_BYTES)
+_flight = SingleFlight()
+_rate_limiter = TokenBucket(rate=RATE_LIMIT)
+
+
+def normalize_query(query: str):
     """
+    Normalize a query so that trivially different queries share a cache entry:
+    case, whitespace and the order of the terms don't matter ("quoted phrases" are kept intact)
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    terms = re.findall(r'[-+]?"[^"]*"|\S+', query)
+    return " ".join(sorted(" ".join(term.split()) for term in terms))
 
-    if not query:
-        raise ValueError("Search query cannot be empty")
 
-    # Get API key from environment
-    api_key = os.getenv("BRAVE_SEARCH_API_KEY")
-    if not api_key:
-        raise ValueError("BRAVE_SEARCH_API_KEY environment variable not set")
+def _cache_key(params: dict):
+    return json.dumps(
+        {**params, "q": normalize_query(params["q"])},
+        sort_keys=True,
+    )
+
 
+def _search(api_key: str, params: dict, max_retries: int):
+    """
+    Call the Brave Search API, or serve the response from the search result cache
+    """
     agent_context = AgentContext.current()
     current_trace = agent_context.tracer.current_trace
     stop_event = agent_context.stop_event
 
-    # Ensure max_results doesn't exceed API limit
-    max_results = min(max_results, 20)
+    cache_key = _cache_key(params)
+    cached = _cache.get(cache_key)
+    if cached and time.time() < cached[0]["expires_at"]:
+        current_trace.add_attribute("ai.tool.search_cache", "hit")
+        return json.loads(cached[1])
+
+    # Identical searches that are in flight (e.g. from other conversations) are joined, rather than repeated
+    while True:
+        try:
+            data, shared = _flight.do(
+                cache_key, lambda: _request(api_key, params, max_retries, cache_key)
+            )
+        except RuntimeError as e:
+            if str(e) == ABORTED and not stop_event.is_set():
+                continue  # The search that we joined was aborted, but this one wasn't
+            raise
+        current_trace.add_attribute(
+            "ai.tool.search_cache", "coalesced" if shared else "miss"
+        )
+        return data
+
+
+def _request(api_key: str, params: dict, max_retries: int, cache_key: str):
+    agent_context = AgentContext.current()
+    current_trace = agent_context.tracer.current_trace
+    stop_event = agent_context.stop_event
 
-    # API endpoint and headers
-    url = "https://api.search.brave.com/res/v1/web/search"
     headers = {
         "X-Subscription-Token": api_key,
         "Accept": "application/json",
         "Accept-Encoding": "gzip",
     }
 
-    params = {
-        "q": query,
-        "count": max_results,
-        "country": "us",
-        "search_lang": "en",
-        "safesearch": "moderate",
-        "text_decorations": False,  # Disable to avoid HTML tags in results
-    }
-
     for i in range(1 + max_retries):
         if stop_event and stop_event.is_set():
-            raise RuntimeError("Aborted due to stop event")
+            raise RuntimeError(ABORTED)
 
-        if i > 0:
-            sleep_for = 1  # min(max(0.5, i * i * 0.25), 30)
-            sleep_till = time.monotonic() + sleep_for
-            current_trace.add_attribute("ai.tool.sleep.for", f"{sleep_for:.1f}")
+        waited = _rate_limiter.acquire(stop_event)
+        if waited:
+            current_trace.add_attribute("ai.tool.rate_limit.wait", f"{waited:.1f}")
             current_trace.emit_snapshot()
-            while time.monotonic() < sleep_till:
-                if stop_event and stop_event.is_set():
-                    raise RuntimeError("Aborted due to stop event")
-                time.sleep(0.1)
 
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = api_session.get(API_URL, headers=headers, params=params, timeout=30)
+        _rate_limiter.update(response.headers)
 
         # Check for rate limiting (HTTP 429)
         if response.status_code == 429:
@@ -80,22 +121,210 @@ def web_search(query: str, max_results: int = 3, max_retries: int = 10) -> list:
         # Raise exception for other HTTP errors
         response.raise_for_status()
 
-        # Parse JSON response
-        data = response.json()
-
-        # Extract results
-        results = []
-        if "web" in data and "results" in data["web"]:
-            for result in data["web"]["results"]:
-                if "title" in result and "url" in result:
-                    results.append({"title": result["title"], "url": result["url"]})
+        _cache.set(cache_key, {"expires_at": time.time() + CACHE_TTL}, response.content)
 
-        return results
+        # Parse JSON response
+        return response.json()
 
     # If we get here, we've exhausted all retries
     raise Exception("Max retries reached")
 
 
+def _api_key():
+    # Get API key from environment
+    api_key = os.getenv("BRAVE_SEARCH_API_KEY")
+    if not api_key:
+        raise ValueError("BRAVE_SEARCH_API_KEY environment variable not set")
+    return api_key
+
+
+def _params(query: str, max_results: int, include_snippets: bool):
+    params = {
+        "q": query,
+        # Ensure max_results doesn't exceed API limit
+        "count": min(max_results, 20),
+        "country": "us",
+        "search_lang": "en",
+        "safesearch": "moderate",
+        "text_decorations": False,  # Disable to avoid HTML tags in results
+    }
+    if include_snippets:
+        params["extra_snippets"] = True
+    return params
+
+
+def _compact(text: str, max_chars: int = SNIPPET_MAX_CHARS):
+    text = " ".join(html.unescape(re.sub(r"<[^>]+>", "", text)).split())
+    return text if len(text) <= max_chars else text[: max_chars - 1] + "…"
+
+
+def _results(data: dict, include_snippets: bool = False):
+    results = []
+    if include_snippets and (infobox := data.get("infobox", {}).get("results")):
+        info = infobox[0]
+        if "title" in info and "url" in info:
+            results.append(
+                {
+                    "title": info["title"],
+                    "url": info["url"],
+                    "infobox": _compact(
+                        info.get("long_desc") or info.get("description", ""),
+                        SNIPPET_MAX_CHARS * 2,
+                    ),
+                }
+            )
+    faqs: dict[str, list[dict]] = {}
+    if include_snippets:
+        for faq in data.get("faq", {}).get("results", []):
+            if "question" in faq and "answer" in faq and "url" in faq:
+                faqs.setdefault(faq["url"], []).append(
+                    {"q": _compact(faq["question"]), "a": _compact(faq["answer"])}
+                )
+    if "web" in data and "results" in data["web"]:
+        for result in data["web"]["results"]:
+            if "title" in result and "url" in result:
+                compact = {"title": result["title"], "url": result["url"]}
+                if include_snippets:
+                    if result.get("description"):
+                        compact["description"] = _compact(result["description"])
+                    if result.get("extra_snippets"):
+                        compact["snippets"] = [
+                            _compact(snippet)
+                            for snippet in result["extra_snippets"][:MAX_SNIPPETS]
+                        ]
+                    if result.get("page_age"):
+                        compact["page_age"] = result["page_age"][:10]
+                    if result["url"] in faqs:
+                        compact["faq"] = faqs[result["url"]]
+                results.append(compact)
+    return results
+
+
+def _prefetch_top_results(results: list[dict]):
+    # The top results are usually fetched next, so start fetching them already
+    if PREFETCH_TOP_K:
+        agent_context = AgentContext.current()
+        prefetching = prefetch(
+            agent_context, [result["url"] for result in results[:PREFETCH_TOP_K]]
+        )
+        agent_context.tracer.current_trace.add_attribute(
+            "ai.tool.prefetch", prefetching
+        )
+
+
+@registry.tool(tool_registry=web_research)
+def web_search(
+    query: str,
+    max_results: int = 3,
+    max_retries: int = 10,
+    include_snippets: bool = False,
+) -> list:
+    """
+    Perform a web search using Brave Search for AI API.
+
+    With include_snippets, each result comes with its description, a few extra snippets from the page,
+    and the page age (plus FAQ answers and an infobox, if the search engine has them).
+    That's often enough to answer a quick lookup, or to decide which pages are worth fetching, without fetching them.
+
+    Parameters
+    -----
+    query : str
+        The query to web search
+    max_results : int
+        Number of results to retrieve (by default: 3, max: 20)
+    max_retries : int
+        Number of times to retry, in case of rate limit errors (by default: 10)
+    include_snippets : bool
+        Include descriptions, snippets and other metadata of the results (by default: False)
+    """
+
+    if not query:
+        raise ValueError("Search query cannot be empty")
+
+    data = _search(
+        _api_key(), _params(query, max_results, include_snippets), max_retries
+    )
+    results = _results(data, include_snippets)
+    _prefetch_top_results(results)
+    return results
+
+
+@registry.tool(tool_registry=web_research)
+def web_search_many(
+    queries: list[str],
+    max_results: int = 3,
+    max_retries: int = 10,
+    include_snippets: bool = False,
+) -> list:
+    """
+    Perform several web searches at once using Brave Search for AI API, and return the combined results.
+
+    Favor this tool over multiple web_search calls, when you want to search for several things at once.
+    Results that are found by more than one query are returned once, listing all queries that found them.
+    Results are ordered by rank: the top result of each query first, then the second result of each query, etc.
+    With include_snippets, results come with their description, snippets and page age, like with web_search.
+
+    Parameters
+    -----
+    queries : list[str]
+        The queries to web search, e.g. ["python asyncio tutorial", "python asyncio best practices"]
+    max_results : int
+        Number of results to retrieve per query (by default: 3, max: 20)
+    max_retries : int
+        Number of times to retry each search, in case of rate limit errors (by default: 10)
+    include_snippets : bool
+        Include descriptions, snippets and other metadata of the results (by default: False)
+    """
+
+    queries = list(dict.fromkeys(query for query in queries if query))
+    if not queries:
+        raise ValueError("Search queries cannot be empty")
+
+    api_key = _api_key()
+    agent_context = AgentContext.current()
+
+    def search(query: str):
+        try:
+            data = _search(
+                api_key, _params(query, max_results, include_snippets), max_retries
+            )
+            return _results(data, include_snippets)
+        except Exception as e:
+            return e
+
+    searched = engine.run_all(
+        [
+            functools.partial(agent_context.copy_context().run, search, query)
+            for query in queries
+        ],
+        limit=MAX_PARALLEL_SEARCHES,
+        stop_event=agent_context.stop_event,
+    )
+
+    merged: dict[str, dict] = {}
+    ranked = [searched.get(i) for i in range(len(queries))]
+    for rank in range(max((len(r) for r in ranked if isinstance(r, list)), default=0)):
+        for query, results in zip(queries, ranked):
+            if not isinstance(results, list) or rank >= len(results):
+                continue
+            result = results[rank]
+            key = canonical_url(result["url"])
+            if key in merged:
+                merged[key]["queries"].append(query)
+            else:
+                merged[key] = {**result, "queries": [query]}
+    combined = list(merged.values())
+
+    _prefetch_top_results(combined)
+
+    for query, results in zip(queries, ranked):
+        if results is None:
+            combined.append({"query": query, "error": ABORTED})
+        elif isinstance(results, Exception):
+            combined.append({"query": query, "error": str(results)})
+    return combined
+
+
 if __name__ == "__main__":
     # Set your API key as an environment variable before running
     # export BRAVE_SEARCH_API_KEY=your_api_key_here